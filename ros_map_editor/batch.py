@@ -0,0 +1,102 @@
+"""
+Headless batch editing.
+
+Applies a script of operations to many maps in parallel without Qt:
+
+    ros-map-editor batch cleanup.yaml maps/*.pgm --output-dir cleaned/
+
+The script is a YAML (or JSON) list of operations as understood by
+core.apply_operation, or a mapping with that list under 'operations'.
+"""
+
+import argparse
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from ros_map_editor.core import MapDocument, MapLoadError, apply_operation, yaml_file
+
+
+def load_script(fn):
+    """Read the list of operations from a YAML or JSON script file"""
+    with open(fn, 'r') as f:
+        script = yaml.safe_load(f)
+    if isinstance(script, dict):
+        script = script.get('operations')
+    if not isinstance(script, list) or not all(isinstance(op, dict) for op in script):
+        raise ValueError("%s does not contain a list of operations" % fn)
+    return script
+
+
+def process_map(fn, operations, output_dir=None):
+    """Apply the operations to one map and save it, return (input, output, error)"""
+    try:
+        doc = MapDocument.load(fn)
+        for op in operations:
+            apply_operation(doc, op)
+
+        if output_dir is None:
+            out = doc.fn
+            doc.save()
+        else:
+            out = os.path.join(output_dir, os.path.basename(doc.fn))
+            doc.save(out)
+            doc.save_metadata(yaml_file(out), image=os.path.basename(out))
+        return fn, out, None
+    except (MapLoadError, ValueError, KeyError, TypeError, OSError) as e:
+        return fn, None, "%s: %s" % (type(e).__name__, e)
+    except Exception:
+        return fn, None, traceback.format_exc()
+
+
+def run_batch(maps, operations, output_dir=None, jobs=None):
+    """Process every map, in a pool of `jobs` worker processes unless jobs is 1
+
+    Yields (input, output, error) tuples in the order the maps were given.
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    if jobs == 1 or len(maps) == 1:
+        for fn in maps:
+            yield process_map(fn, operations, output_dir)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(process_map, fn, operations, output_dir) for fn in maps]
+        for future in futures:
+            yield future.result()
+
+
+def main(argv=None):
+    """Entry point of the batch subcommand, returns the process exit code"""
+    parser = argparse.ArgumentParser(prog='ros-map-editor batch',
+                                     description='Apply scripted edits to many map files without a display')
+    parser.add_argument('script', help='YAML or JSON file with the list of operations')
+    parser.add_argument('maps', nargs='+', help='Map files (.pgm or without extension)')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('-o', '--output-dir', help='Write the edited maps and their YAML files here')
+    target.add_argument('--in-place', action='store_true', help='Overwrite the input maps')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    try:
+        operations = load_script(args.script)
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        print("ERROR:  Cannot read script", args.script, "-", e)
+        return 2
+
+    failed = 0
+    for fn, out, error in run_batch(args.maps, operations, args.output_dir, args.jobs):
+        if error is None:
+            print('Saved', out)
+        else:
+            failed += 1
+            print("ERROR: ", fn, "-", error)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Performance benchmarks of the map editor.
+
+Generates synthetic maps from 384x384 up to 16384x16384 cells, times
+loading, rendering, zooming, filling, the minimap and saving on each of
+them headless and writes the results as JSON that can be compared between
+versions:
+
+    ros-map-editor benchmark run --sizes 384 4096 -o before.json
+    ros-map-editor benchmark run --sizes 384 4096 -o after.json
+    ros-map-editor benchmark compare before.json after.json
+"""
+
+import argparse
+import json
+import sys
+
+
+def main(argv=None):
+    """Entry point of the benchmark subcommand, returns the process exit code"""
+    parser = argparse.ArgumentParser(prog='ros-map-editor benchmark',
+                                     description='Time editor operations on synthetic maps')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run = commands.add_parser('run', help='Run the benchmarks and write the results')
+    run.add_argument('--sizes', type=int, nargs='+', help='Map sizes in cells per side (default: 384 1024 4096 16384)')
+    run.add_argument('-r', '--repeat', type=int, default=5, help='Runs per case (default: 5)')
+    run.add_argument('-o', '--output', help='Write the JSON results here instead of standard output')
+    run.add_argument('--workdir', help='Keep the generated maps in this directory and reuse them')
+
+    compare = commands.add_parser('compare', help='Compare two result files')
+    compare.add_argument('old', help='Results of the baseline')
+    compare.add_argument('new', help='Results to check')
+    compare.add_argument('--threshold', type=float, default=1.2,
+                         help='Slowdown of the median that counts as a regression (default: 1.2)')
+
+    generate = commands.add_parser('generate', help='Only write the synthetic maps')
+    generate.add_argument('directory', help='Output directory')
+    generate.add_argument('--sizes', type=int, nargs='+', help='Map sizes in cells per side')
+    generate.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        from ros_map_editor.benchmark.suite import run as run_suite, SIZES
+        results = run_suite(args.sizes or SIZES, args.repeat, args.workdir,
+                            progress=lambda message: print(message, file=sys.stderr))
+        text = json.dumps(results, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+            print('Saved', args.output, file=sys.stderr)
+        else:
+            print(text)
+        return 0
+
+    if args.command == 'compare':
+        from ros_map_editor.benchmark.compare import compare as compare_results, format_table
+        try:
+            with open(args.old) as f:
+                old = json.load(f)
+            with open(args.new) as f:
+                new = json.load(f)
+        except (OSError, ValueError) as e:
+            print("ERROR:  Cannot read results -", e)
+            return 2
+        rows = compare_results(old, new, args.threshold)
+        print(format_table(rows, old.get('version', 'old'), new.get('version', 'new')))
+        return 1 if any(row[-1] for row in rows) else 0
+
+    from ros_map_editor.benchmark.suite import SIZES
+    from ros_map_editor.benchmark.synthetic import write_map
+    for size in args.sizes or SIZES:
+        print('Saved', write_map(args.directory, size, args.seed))
+    return 0
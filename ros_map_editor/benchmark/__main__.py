@@ -0,0 +1,5 @@
+import sys
+
+from ros_map_editor.benchmark import main
+
+sys.exit(main())
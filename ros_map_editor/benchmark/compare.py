@@ -0,0 +1,35 @@
+"""
+Comparison of two benchmark result files.
+"""
+
+from ros_map_editor.benchmark.suite import CASES
+
+
+def compare(old, new, threshold=1.2):
+    """Match the cases of two results documents by map size
+
+    Returns rows of (size, case, old_median, new_median, ratio, regressed),
+    a case regressed when its median grew by more than `threshold` times.
+    """
+    rows = []
+    for size, cases in new['results'].items():
+        before = old['results'].get(size)
+        if before is None:
+            continue
+        for case in CASES:
+            if case not in cases or case not in before:
+                continue
+            a = before[case]['median']
+            b = cases[case]['median']
+            ratio = b / a if a else float('inf')
+            rows.append((size, case, a, b, ratio, ratio > threshold))
+    return rows
+
+
+def format_table(rows, old_label='old', new_label='new'):
+    """Render comparison rows as a plain text table, times in milliseconds"""
+    lines = ['%8s  %-10s %12s %12s %8s' % ('size', 'case', old_label[:12], new_label[:12], 'ratio')]
+    for size, case, a, b, ratio, regressed in rows:
+        lines.append('%8s  %-10s %12.2f %12.2f %7.2fx%s' % (size, case, a * 1e3, b * 1e3, ratio,
+                                                             '  REGRESSION' if regressed else ''))
+    return '\n'.join(lines)
@@ -0,0 +1,171 @@
+"""
+Timed editor operations on synthetic maps.
+
+Every case drives the real MapEditor window on the offscreen Qt platform
+and forces the repaint it would cause, so the numbers include rendering.
+Each case runs `repeat` times, results keep every run together with the
+minimum and median.
+"""
+
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from ros_map_editor import __version__
+from ros_map_editor.benchmark.synthetic import write_map
+
+SIZES = (384, 1024, 4096, 16384)
+
+CASES = ('load', 'open', 'render', 'zoom', 'box_fill', 'line_fill', 'minimap', 'save')
+
+
+def _timed(runs, func):
+    """Call func `runs` times, return the durations in seconds"""
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _summary(times):
+    return {'min': min(times), 'median': statistics.median(times), 'runs': times}
+
+
+def close(window):
+    """Dispose of an editor window without the interactive close handling"""
+    from PyQt5 import QtCore
+    window.hide()
+    window.saver.shutdown()
+    window.loader.shutdown()
+    # the timed edits are no work to recover
+    for entry in window.session.entries:
+        if entry.journal is not None:
+            entry.journal.discard()
+    window.session.close()
+    window.deleteLater()
+    # free the map now, deferred deletes would otherwise wait for an event loop
+    QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+
+
+def bench_map(app, fn, repeat=5):
+    """Time every case on one map file, return {case: summary}"""
+    from ros_map_editor.core import MapDocument
+    from ros_map_editor.map_editor import MapEditor
+
+    results = {}
+    results['load'] = _summary(_timed(repeat, lambda i: MapDocument.load(fn)))
+
+    windows = []
+
+    def open_window(i):
+        if windows:
+            close(windows.pop())
+        window = MapEditor(fn)
+        window.show()
+        # the map is loaded on the loader thread and shown from the event loop
+        while window.minimap is None:
+            app.processEvents()
+        windows.append(window)
+
+    results['open'] = _summary(_timed(repeat, open_window))
+    window = windows[0]
+    viewport = window.ui.graphicsView.viewport()
+    model = window.model
+
+    def render(i):
+        window.layer.cache.clear()
+        viewport.repaint()
+
+    def paint():
+        # what the frame timer would do, then the repaint it causes
+        window.frame_timer.stop()
+        window.paintFrame()
+        viewport.repaint()
+
+    results['render'] = _summary(_timed(repeat, render))
+
+    base = window.pixels_per_cell
+    zooms = [base / 8, base * 4, base / 2, base * 2]
+    results['zoom'] = _summary(_timed(repeat, lambda i: (window.setZoom(zooms[i % len(zooms)]),
+                                                          viewport.repaint())))
+    window.setZoom(base)
+
+    colors = ('occupied', 'unoccupied')
+    quarter = model.width // 4, model.height // 4
+
+    def box_fill(i):
+        window.color = colors[i % 2]
+        window.start_pos = quarter
+        window.end_pos = (model.width - quarter[0] - 1, model.height - quarter[1] - 1)
+        window.fillSelectedArea()
+        paint()
+
+    def line_fill(i):
+        window.color = colors[i % 2]
+        window.start_pos = (0, 0)
+        window.end_pos = (model.width - 1, model.height - 1)
+        window.fillLineBetweenPoints()
+        paint()
+
+    results['box_fill'] = _summary(_timed(repeat, box_fill))
+    results['line_fill'] = _summary(_timed(repeat, line_fill))
+
+    def minimap(i):
+        window.pyramid.update(0, 0, model.width, model.height)
+        window.minimap.refresh(0, 0, model.width, model.height)
+        window.scrollChanged(0)
+
+    results['minimap'] = _summary(_timed(repeat, minimap))
+
+    directory = tempfile.mkdtemp(prefix='ros_map_editor_bench_')
+    try:
+        out = os.path.join(directory, 'saved.pgm')
+
+        def save(i):
+            # a full rewrite, every row counts as changed
+            model.mark_rows(0, model.height)
+            window.saver.save(out, window.document).result()
+
+        results['save'] = _summary(_timed(repeat, save))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    close(window)
+    return results
+
+
+def run(sizes=SIZES, repeat=5, workdir=None, progress=print):
+    """Generate a map of every size and time all cases on it, return the results document"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtWidgets
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([sys.argv[0]])
+
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='ros_map_editor_maps_')
+    results = {}
+    try:
+        for size in sizes:
+            fn = os.path.join(workdir, 'map_%d.pgm' % size)
+            if not os.path.exists(fn):
+                progress('Generating %dx%d map' % (size, size))
+                write_map(workdir, size)
+            progress('Timing %s' % fn)
+            results[str(size)] = bench_map(app, fn, repeat)
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': repeat,
+        'results': results,
+    }
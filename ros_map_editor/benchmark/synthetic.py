@@ -0,0 +1,65 @@
+"""
+Synthetic maps that look like SLAM output.
+
+A square map is covered with a grid of rooms, most of them explored: free
+inside, walled with doors in the middle of every wall, the rest unknown.
+Free space is sprinkled with isolated occupied cells the way a noisy scan
+leaves them.  The same size and seed always give the same map.
+"""
+
+import os
+
+import numpy as np
+import yaml
+
+from ros_map_editor import pgm
+
+FREE = 254
+UNKNOWN = 205
+OCCUPIED = 0
+
+METADATA = {
+    'resolution': 0.05,
+    'origin': [-10.0, -10.0, 0.0],
+    'negate': 0,
+    'occupied_thresh': 0.65,
+    'free_thresh': 0.196,
+}
+
+
+def generate_map(size, seed=0, room=None, noise=0.001):
+    """Return a size x size uint8 map of walled rooms with scan noise"""
+    rng = np.random.default_rng(seed)
+    room = room or max(16, size // 24)
+    rooms = size // room + 1
+    explored = rng.random((rooms, rooms)) < 0.85
+
+    cells = np.arange(size)
+    index = cells // room
+    offset = cells % room
+    door = max(1, room // 8)
+    # a cell is on a wall when it sits on the first row or column of its room,
+    # except for the door gap halfway along that wall
+    in_gap = np.abs(offset - room // 2) < door
+    row_wall = (offset == 0)[:, None] & ~in_gap[None, :]
+    col_wall = (offset == 0)[None, :] & ~in_gap[:, None]
+
+    inside = explored[index[:, None], index[None, :]]
+    data = np.where(inside, np.uint8(FREE), np.uint8(UNKNOWN))
+    data[inside & (row_wall | col_wall)] = OCCUPIED
+
+    speckle = rng.integers(0, size * size, int(size * size * noise))
+    flat = data.ravel()
+    flat[speckle[flat[speckle] == FREE]] = OCCUPIED
+    return data
+
+
+def write_map(directory, size, seed=0):
+    """Write map_<size>.pgm and its YAML file into `directory`, return the image name"""
+    os.makedirs(directory, exist_ok=True)
+    fn = os.path.join(directory, 'map_%d.pgm' % size)
+    pgm.write_pgm(fn, generate_map(size, seed))
+    metadata = dict(METADATA, image=os.path.basename(fn))
+    with open(os.path.splitext(fn)[0] + '.yaml', 'w') as f:
+        yaml.safe_dump(metadata, f, default_flow_style=None, sort_keys=False)
+    return fn
@@ -0,0 +1,49 @@
+"""
+Freehand brush strokes.
+
+A stroke collects the cursor samples of one drag, fills the cells between
+consecutive samples and keeps the painted cells until the display asks for
+them, so the window can repaint once per frame instead of once per event.
+"""
+
+import numpy as np
+
+from ros_map_editor.raster import line_cells, brush_cells
+
+
+class BrushStroke(object):
+    """One freehand stroke of a round brush writing a fixed value into a MapModel"""
+
+    def __init__(self, model, value, radius=0):
+        self.model = model
+        self.value = value
+        self.radius = radius
+        self.last = None
+        # every sample in order, enough to paint the stroke again
+        self.points = []
+        self.pending = []
+
+    def add(self, x, y):
+        """Paint from the previous sample to (x, y), return False if the sample added nothing"""
+        if self.last == (x, y):
+            return False
+        x0, y0 = self.last if self.last is not None else (x, y)
+        self.last = (x, y)
+        self.points.append((x, y))
+
+        xs, ys = line_cells(x0, y0, x, y)
+        xs, ys = brush_cells(xs, ys, self.radius, self.model.data.shape)
+        if self.model.fill_points(xs, ys, self.value) is None:
+            return False
+        self.pending.append((xs, ys))
+        return True
+
+    def take_dirty(self):
+        """Return the cells painted since the last call as (xs, ys) arrays"""
+        if not self.pending:
+            empty = np.empty(0, dtype=np.intp)
+            return empty, empty
+        xs = np.concatenate([xs for xs, ys in self.pending])
+        ys = np.concatenate([ys for xs, ys in self.pending])
+        self.pending = []
+        return xs, ys
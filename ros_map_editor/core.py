@@ -0,0 +1,282 @@
+"""
+Qt-free editing core.
+
+Loads a map image together with its YAML metadata into a MapDocument and
+applies editing operations to it.  The editor window and the batch command
+line both build on this module, scripts can use it directly:
+
+    doc = MapDocument.load('maps/map')
+    apply_operation(doc, {'op': 'box', 'rect': [10, 10, 50, 20], 'value': 'occupied'})
+    doc.save()
+"""
+
+import base64
+import os
+import zlib
+
+import numpy as np
+import yaml
+
+from ros_map_editor import pgm
+from ros_map_editor.map_model import MapModel
+from ros_map_editor.brush import BrushStroke
+from ros_map_editor.history import run_indices
+from ros_map_editor.raster import thick_line, polygon_spans, unique_cells
+from ros_map_editor import filters
+
+# cell values written for the editor's color names
+COLOR_VALUES = {
+    'occupied': 0,
+    'unoccupied': 255,
+    'uncertain': 200,
+}
+
+
+class MapLoadError(Exception):
+    """Raised when a map image or its YAML file cannot be loaded"""
+
+
+def resolve_map_file(fn):
+    """Return the map image path for a name given with or without .pgm extension"""
+    if os.path.isfile(fn):
+        return fn
+    if os.path.isfile(fn + '.pgm'):
+        return fn + '.pgm'
+    raise MapLoadError("Cannot open file %s or %s" % (fn, fn + '.pgm'))
+
+
+def yaml_file(fn):
+    return os.path.splitext(fn)[0] + '.yaml'
+
+
+def load_metadata(fn_yaml):
+    """Read the map YAML file, the last document in the stream wins"""
+    try:
+        with open(fn_yaml, "r") as stream:
+            metadata = None
+            for doc in yaml.load_all(stream, Loader=yaml.FullLoader):
+                metadata = doc
+        # every value the editor relies on has to be present and numeric
+        for value in (metadata['occupied_thresh'], metadata['free_thresh'], metadata['resolution'],
+                      metadata['origin'][0], metadata['origin'][1]):
+            float(value)
+    except Exception:
+        raise MapLoadError("Corresponding YAML file %s is missing or incorrectly formatted." % fn_yaml)
+    return metadata
+
+
+class MapDocument(object):
+    """A map image held in a MapModel together with its YAML metadata
+
+    The model works on 0-255 cells, `maxval`, `plain` and the `raw` samples
+    read from the file make saving write the map back in its own format.
+    """
+
+    def __init__(self, fn, model, metadata, maxval=255, plain=False, raw=None):
+        self.fn = fn
+        self.model = model
+        self.metadata = metadata
+        self.maxval = maxval
+        self.plain = plain
+        # samples as read, kept when they do not fit the model's cells exactly
+        self.raw = raw
+
+    @classmethod
+    def load(cls, fn, mmap=True):
+        """Load `fn` or `fn`.pgm and the YAML file next to it"""
+        fn = resolve_map_file(fn)
+        try:
+            data, header = pgm.read_pgm(fn, mmap)
+        except pgm.PGMError as e:
+            raise MapLoadError("%s is not a readable PGM file: %s" % (fn, e))
+        except OSError as e:
+            raise MapLoadError("Cannot open file %s: %s" % (fn, e))
+        metadata = load_metadata(yaml_file(fn))
+        cells = pgm.to_uint8(data, header.maxval)
+        return cls(fn, MapModel(cells), metadata, header.maxval, not header.binary,
+                   None if cells is data else data)
+
+    @property
+    def occupied_thresh(self):
+        return self.metadata['occupied_thresh']  # probability its occupied
+
+    @property
+    def free_thresh(self):
+        return self.metadata['free_thresh']  # probability its uncertain or occupied
+
+    @property
+    def resolution(self):
+        return self.metadata['resolution']  # in meters per cell
+
+    @property
+    def origin(self):
+        return self.metadata['origin']
+
+    def samples(self, rows=None, copy=False):
+        """Samples to write for the map or some of its rows, in the file's maxval
+
+        With `copy` the result never shares memory with the model.
+        """
+        data = self.model.data if rows is None else self.model.data[rows]
+        if self.raw is None and self.maxval == 255:
+            return data.copy() if copy and rows is None else data
+        raw = None if self.raw is None else self.raw if rows is None else self.raw[rows]
+        return pgm.from_uint8(data, self.maxval, raw)
+
+    def save(self, fn=None):
+        """Write the map image in its own format, to its own file unless `fn` is given"""
+        pgm.write_pgm(fn or self.fn, self.samples(), self.maxval, self.plain)
+
+    def save_metadata(self, fn_yaml, **changes):
+        """Write the metadata with some keys changed, `image` defaults to the matching image name"""
+        metadata = dict(self.metadata)
+        metadata.setdefault('image', os.path.basename(os.path.splitext(fn_yaml)[0] + '.pgm'))
+        metadata.update(changes)
+        with open(fn_yaml, 'w') as f:
+            yaml.safe_dump(metadata, f, default_flow_style=None, sort_keys=False)
+
+
+def encode_array(value):
+    """JSON form of a NumPy array or scalar, arrays are stored zlib compressed"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        data = zlib.compress(np.ascontiguousarray(value).tobytes())
+        return {'dtype': value.dtype.str, 'shape': list(value.shape), 'zlib': base64.b64encode(data).decode('ascii')}
+    raise TypeError("%r is not JSON serializable" % type(value).__name__)
+
+
+def decode_array(value):
+    """Array from the JSON form written by encode_array, plain numbers are returned as they are"""
+    if not isinstance(value, dict):
+        return value
+    data = zlib.decompress(base64.b64decode(value['zlib']))
+    return np.frombuffer(data, dtype=np.dtype(value['dtype'])).reshape(value['shape']).copy()
+
+
+def parse_value(value):
+    """Accept a cell value 0-255 or one of the COLOR_VALUES names"""
+    if isinstance(value, str):
+        try:
+            return COLOR_VALUES[value]
+        except KeyError:
+            raise ValueError("unknown color %r, expected one of %s" % (value, ', '.join(COLOR_VALUES)))
+    value = int(value)
+    if not 0 <= value <= 255:
+        raise ValueError("cell value %d out of range 0-255" % value)
+    return value
+
+
+def apply_operation(doc, op):
+    """Apply one operation given as a dict to a MapDocument, return the changed rectangle
+
+    Supported operations, coordinates are in cells:
+
+    - ``{'op': 'box', 'rect': [x0, y0, x1, y1], 'value': v}``
+    - ``{'op': 'line', 'points': [[x, y], ...], 'width': 3, 'value': v}``
+    - ``{'op': 'stroke', 'points': [[x, y], ...], 'radius': 0, 'value': v}``,
+      a freehand stroke of the editor's round brush through the samples
+    - ``{'op': 'polygon', 'points': [[x, y], ...], 'value': v}``
+    - ``{'op': 'fill', 'seed': [x, y], 'connectivity': 4, 'value': v}``,
+      fills the region of cells in the same class as the seed
+    - ``{'op': 'threshold', 'rect': [x0, y0, x1, y1], 'occupied_thresh': t,
+      'free_thresh': t, 'values': [free, unknown, occupied]}``, everything
+      but 'op' optional, snaps cells to the value of their class
+    - ``{'op': 'despeckle', 'min_size': 10, 'rect': [x0, y0, x1, y1]}``,
+      turns smaller occupied blobs into free cells
+    - ``{'op': 'dilate' | 'erode' | 'open' | 'close', 'radius': 1,
+      'rect': [x0, y0, x1, y1]}``, applied to the occupied cells
+    - ``{'op': 'cells', 'parts': [{'rect': [x, y, width, height], 'data': a},
+      {'rect': [x, y, width, height], 'value': v}, {'flat': a, 'values': a},
+      {'starts': a, 'lengths': a, 'values': a}]}``, writes literal cells in
+      order, blocks, uniform rectangles, cells by flat index or runs of
+      consecutive flat indices, arrays in the form encode_array writes.  Undo
+      and redo are journaled this way
+    """
+    model = doc.model
+    kind = op.get('op')
+
+    if kind == 'box':
+        x0, y0, x1, y1 = op['rect']
+        return model.fill_rect(x0, y0, x1, y1, parse_value(op['value']))
+
+    if kind == 'line':
+        points = op['points']
+        if len(points) < 2:
+            raise ValueError("a line needs at least two points")
+        width = int(op.get('width', 3))
+        parts = [thick_line(a[0], a[1], b[0], b[1], width, model.data.shape)
+                 for a, b in zip(points[:-1], points[1:])]
+        xs, ys = unique_cells(np.concatenate([p[0] for p in parts]),
+                              np.concatenate([p[1] for p in parts]), model.data.shape)
+        return model.fill_points(xs, ys, parse_value(op['value']))
+
+    if kind == 'stroke':
+        stroke = BrushStroke(model, parse_value(op['value']), int(op.get('radius', 0)))
+        for x, y in op['points']:
+            stroke.add(int(x), int(y))
+        xs, ys = stroke.take_dirty()
+        if not len(xs):
+            return None
+        x0, y0 = int(xs.min()), int(ys.min())
+        return (x0, y0, int(xs.max()) - x0 + 1, int(ys.max()) - y0 + 1)
+
+    if kind == 'cells':
+        rects = []
+        for part in op['parts']:
+            if 'rect' in part:
+                x, y, width, height = (int(v) for v in part['rect'])
+                if x < 0 or y < 0 or x + width > model.width or y + height > model.height:
+                    raise ValueError("cells %r lie outside the map" % (part['rect'],))
+                if 'value' in part:
+                    rects.append(model.fill_rect(x, y, x + width - 1, y + height - 1, parse_value(part['value'])))
+                else:
+                    block = decode_array(part['data'])
+                    if block.shape != (height, width):
+                        raise ValueError("cells do not match their rectangle %r" % (part['rect'],))
+                    rects.append(model.write_rect(x, y, block.astype(np.uint8)))
+            else:
+                if 'starts' in part:
+                    flat = run_indices(decode_array(part['starts']), decode_array(part['lengths']))
+                else:
+                    flat = decode_array(part['flat'])
+                rect = model.write_cells(flat, decode_array(part['values']))
+                if rect is not None:
+                    rects.append(rect)
+        if not rects:
+            return None
+        x0, y0 = min(r[0] for r in rects), min(r[1] for r in rects)
+        return (x0, y0, max(r[0] + r[2] for r in rects) - x0, max(r[1] + r[3] for r in rects) - y0)
+
+    if kind == 'polygon':
+        rows, starts, ends = polygon_spans(op['points'], model.data.shape)
+        return model.fill_spans(rows, starts, ends, parse_value(op['value']))
+
+    if kind == 'fill':
+        x, y = (int(v) for v in op['seed'])
+        if not model.contains(x, y):
+            raise ValueError("seed (%d, %d) lies outside the map" % (x, y))
+        connectivity = int(op.get('connectivity', 4))
+        if connectivity not in (4, 8):
+            raise ValueError("connectivity must be 4 or 8")
+        region = model.region_at(x, y, doc.occupied_thresh, doc.free_thresh, connectivity)
+        return model.fill_mask(*region, parse_value(op['value']))
+
+    rect = None
+    if 'rect' in op:
+        rect = model.clip_rect(*op['rect'])
+        if rect is None:
+            return None
+
+    if kind == 'threshold':
+        values = [parse_value(v) for v in op.get('values', (255, 205, 0))]
+        return model.quantize(op.get('occupied_thresh', doc.occupied_thresh),
+                              op.get('free_thresh', doc.free_thresh), rect, values)
+
+    if kind == 'despeckle':
+        return filters.despeckle(model, doc.occupied_thresh, doc.free_thresh, int(op.get('min_size', 10)), rect)
+
+    if kind in filters.MORPHOLOGY:
+        return filters.morphology(model, kind, doc.occupied_thresh, doc.free_thresh, int(op.get('radius', 1)), rect)
+
+    raise ValueError("unknown operation %r" % kind)
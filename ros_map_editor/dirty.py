@@ -0,0 +1,97 @@
+"""
+Tracking of the map cells that need to be repainted.
+
+Edits report the rectangles they changed, overlapping or touching
+rectangles are merged as they arrive and the display takes the merged set
+once per frame.  Scattered cells, such as the ones of a brush stroke, are
+reported per tile so a long thin stroke does not dirty its whole bounding
+box.
+"""
+
+import numpy as np
+
+
+def _area(rect):
+    return (rect[2] - rect[0]) * (rect[3] - rect[1])
+
+
+def tile_rects(xs, ys, tile_size=256):
+    """Bounding rectangles (x, y, width, height) of scattered cells, one per tile they fall into"""
+    if not len(xs):
+        return []
+    xs = np.asarray(xs, dtype=np.intp)
+    ys = np.asarray(ys, dtype=np.intp)
+    keys = (ys // tile_size) * (int(xs.max()) // tile_size + 1) + xs // tile_size
+    order = np.argsort(keys, kind='stable')
+    keys, xs, ys = keys[order], xs[order], ys[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(keys)) + 1]
+    x0 = np.minimum.reduceat(xs, starts)
+    y0 = np.minimum.reduceat(ys, starts)
+    x1 = np.maximum.reduceat(xs, starts) + 1
+    y1 = np.maximum.reduceat(ys, starts) + 1
+    return list(zip(x0.tolist(), y0.tolist(), (x1 - x0).tolist(), (y1 - y0).tolist()))
+
+
+def span_rects(rows, starts, ends, tile_size=256):
+    """Bounding rectangles of horizontal spans, one per band of tile rows they fall into
+
+    `rows` must be sorted, `ends` are exclusive.
+    """
+    if not len(rows):
+        return []
+    bands = np.asarray(rows) // tile_size
+    first = np.r_[0, np.flatnonzero(np.diff(bands)) + 1]
+    x0 = np.minimum.reduceat(starts, first)
+    x1 = np.maximum.reduceat(ends, first)
+    y0 = np.asarray(rows)[first]
+    y1 = np.r_[np.asarray(rows)[first[1:] - 1], rows[-1]] + 1
+    return list(zip(x0.tolist(), y0.tolist(), (x1 - x0).tolist(), (y1 - y0).tolist()))
+
+
+class DirtyRegion(object):
+    """Set of dirty cell rectangles that merges rectangles as they are added"""
+
+    # above this many separate rectangles everything collapses into their bounding box
+    MAX_RECTS = 64
+
+    def __init__(self, tile_size=256):
+        self.tile_size = tile_size
+        # rectangles as (x0, y0, x1, y1) with exclusive x1 and y1
+        self.rects = []
+
+    def __bool__(self):
+        return bool(self.rects)
+
+    def add(self, x, y, width=1, height=1):
+        """Mark a rectangle of cells dirty"""
+        if width <= 0 or height <= 0:
+            return
+        rect = (x, y, x + width, y + height)
+        merged = True
+        while merged:
+            merged = False
+            for i, other in enumerate(self.rects):
+                union = (min(rect[0], other[0]), min(rect[1], other[1]),
+                         max(rect[2], other[2]), max(rect[3], other[3]))
+                # merge when the union repaints no more cells than both apart
+                if _area(union) <= _area(rect) + _area(other):
+                    rect = union
+                    del self.rects[i]
+                    merged = True
+                    break
+        self.rects.append(rect)
+
+        if len(self.rects) > self.MAX_RECTS:
+            self.rects = [(min(r[0] for r in self.rects), min(r[1] for r in self.rects),
+                           max(r[2] for r in self.rects), max(r[3] for r in self.rects))]
+
+    def add_cells(self, xs, ys):
+        """Mark scattered cells dirty, as one bounding rectangle per tile they fall into"""
+        for rect in tile_rects(xs, ys, self.tile_size):
+            self.add(*rect)
+
+    def take(self):
+        """Return the merged rectangles as (x, y, width, height) and start afresh"""
+        rects = [(r[0], r[1], r[2] - r[0], r[3] - r[1]) for r in self.rects]
+        self.rects = []
+        return rects
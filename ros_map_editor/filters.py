@@ -0,0 +1,87 @@
+"""
+Cleanup filters for whole maps or rectangles of them.
+
+Every filter classifies the cells with the map thresholds, works on whole
+boolean masks and writes its result back with a single MapModel.write_rect,
+so a filter is one undoable edit and needs one repaint of the returned
+rectangle.
+"""
+
+import numpy as np
+
+from ros_map_editor.map_model import OCCUPIED
+from ros_map_editor.regions import mask_runs, run_links, label_runs, spans_mask
+
+MORPHOLOGY = ('dilate', 'erode', 'open', 'close')
+
+
+def dilate(mask, radius=1):
+    """Grow a mask by a square of the given radius, cells outside count as unset"""
+    out = mask.copy()
+    for shift in range(1, radius + 1):
+        out[shift:, :] |= mask[:-shift, :]
+        out[:-shift, :] |= mask[shift:, :]
+    rows = out.copy()
+    for shift in range(1, radius + 1):
+        out[:, shift:] |= rows[:, :-shift]
+        out[:, :-shift] |= rows[:, shift:]
+    return out
+
+
+def erode(mask, radius=1):
+    """Shrink a mask by a square of the given radius, cells outside count as set"""
+    return ~dilate(~mask, radius)
+
+
+def small_components(mask, min_size, connectivity=8):
+    """Mask of the cells in connected components of fewer than `min_size` cells"""
+    rows, starts, ends = mask_runs(mask)
+    small = np.zeros_like(mask)
+    if not rows.size:
+        return small
+    a, b = run_links(rows, starts, ends, mask.shape[1], connectivity)
+    labels = label_runs(rows.size, a, b)
+    sizes = np.bincount(labels, weights=ends - starts, minlength=rows.size)
+    keep = sizes[labels] < min_size
+    if keep.any():
+        x, y, spans = spans_mask(rows[keep], starts[keep], ends[keep])
+        small[y:y + spans.shape[0], x:x + spans.shape[1]] = spans
+    return small
+
+
+def _region(model, rect):
+    x, y, width, height = rect if rect is not None else (0, 0, model.width, model.height)
+    return x, y, model.data[y:y + height, x:x + width]
+
+
+def despeckle(model, occupied_thresh, free_thresh, min_size, rect=None, free=255):
+    """Turn occupied blobs of fewer than `min_size` cells into free cells"""
+    x, y, view = _region(model, rect)
+    occupied = model.classify(occupied_thresh, free_thresh, rect) == OCCUPIED
+    block = np.where(small_components(occupied, min_size), np.uint8(free), view)
+    return model.write_rect(x, y, block)
+
+
+def morphology(model, op, occupied_thresh, free_thresh, radius=1, rect=None, occupied=0, free=255):
+    """Dilate, erode, open or close the occupied cells
+
+    Cells that join the occupied area become `occupied`, cells that leave it
+    become `free`.
+    """
+    if op not in MORPHOLOGY:
+        raise ValueError("unknown morphology operation %r, expected one of %s" % (op, ', '.join(MORPHOLOGY)))
+    x, y, view = _region(model, rect)
+    before = model.classify(occupied_thresh, free_thresh, rect) == OCCUPIED
+    if op == 'dilate':
+        after = dilate(before, radius)
+    elif op == 'erode':
+        after = erode(before, radius)
+    elif op == 'open':
+        after = dilate(erode(before, radius), radius)
+    else:
+        after = erode(dilate(before, radius), radius)
+
+    block = view.copy()
+    block[after & ~before] = occupied
+    block[before & ~after] = free
+    return model.write_rect(x, y, block)
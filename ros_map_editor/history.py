@@ -0,0 +1,283 @@
+"""
+Undo/redo history for a MapModel.
+
+Every edit stores only the cells it actually changed: their flat indices
+as runs of consecutive cells within a row, their old values and their new
+values, the latter collapsed to a single value for uniform fills.  Writes
+to a rectangle are compared a band of rows at a time and turned into runs
+directly, so a large fill or filter never costs per-cell coordinates and
+undoing it writes whole runs at once.  The total size of the stored edits
+is capped and the oldest edits are dropped first.
+"""
+
+import numpy as np
+
+from ros_map_editor.dirty import span_rects
+from ros_map_editor.regions import mask_runs
+
+# rows compared at a time while recording, bounds the temporary memory
+BAND = 256
+# runs at least this long on average are written one slice each instead of cell by cell
+SLICE_RUN_LENGTH = 16
+
+
+def run_indices(starts, lengths):
+    """Expand runs of consecutive cells into their flat indices"""
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(int(np.sum(lengths)))
+
+
+def flat_runs(flat, width):
+    """Runs of sorted unique flat indices as (starts, lengths), split where a row ends"""
+    breaks = np.flatnonzero((np.diff(flat) != 1) | (flat[1:] % width == 0)) + 1
+    bounds = np.r_[0, breaks, flat.size]
+    return flat[bounds[:-1]], np.diff(bounds)
+
+
+def changed_runs(view, new, x, y, stride):
+    """Runs of the cells of `view`, the slice of the map at (x, y), that differ from `new`
+
+    `new` is a value or a block of the same shape.  Returns (starts, lengths,
+    old, values) with flat starts in a map `stride` cells wide, `values` is
+    None when `new` is a value, or None when nothing changes.
+    """
+    uniform = np.ndim(new) == 0
+    parts = []
+    for top in range(0, view.shape[0], BAND):
+        band = view[top:top + BAND]
+        target = new if uniform else new[top:top + BAND]
+        changed = band != target
+        count = np.count_nonzero(changed)
+        if not count:
+            continue
+        if count == changed.size:
+            # every row of the band is one run, as for most of a large fill
+            rows = np.arange(band.shape[0])
+            starts = np.zeros_like(rows)
+            ends = np.full_like(rows, band.shape[1])
+        elif count * 8 < changed.size:
+            # few changed cells, as after a filter, are cheaper to find one by one
+            first, lengths = flat_runs(np.flatnonzero(changed), band.shape[1])
+            rows, starts = np.divmod(first, band.shape[1])
+            ends = starts + lengths
+        else:
+            rows, starts, ends = mask_runs(changed)
+        # runs and boolean indexing both go in row-major order
+        parts.append(((y + top + rows) * stride + x + starts, (ends - starts).astype(np.int32),
+                      band[changed], None if uniform else target[changed]))
+    if not parts:
+        return None
+    starts, lengths, old, values = (np.concatenate(p) if p[0] is not None else None for p in zip(*parts))
+    return starts, lengths, old, values
+
+
+class Cells(object):
+    """Cells changed by one or more writes, as runs within rows"""
+
+    def __init__(self, starts, lengths, old, new):
+        self.starts = starts
+        self.lengths = lengths
+        self.old = old
+        self.new = new[0] if np.ndim(new) and new.size and (new == new[0]).all() else new
+
+    @classmethod
+    def from_flat(cls, flat, old, new, width):
+        """Cells from sorted unique flat indices, runs are split where a row ends"""
+        starts, lengths = flat_runs(flat, width)
+        return cls(starts, lengths.astype(np.int32), old, new)
+
+    @classmethod
+    def merge(cls, parts, width):
+        """One part from (flat, old, new) writes made in order"""
+        if len(parts) > 1:
+            flat = np.concatenate([p[0] for p in parts])
+            old = np.concatenate([p[1] for p in parts])
+            new = np.concatenate([p[2] for p in parts])
+            # a cell written twice keeps its first old and its last new value
+            unique, first = np.unique(flat, return_index=True)
+            last = flat.size - 1 - np.unique(flat[::-1], return_index=True)[1]
+            flat, old, new = unique, old[first], new[last]
+        else:
+            flat, old, new = parts[0]
+            if (flat[1:] < flat[:-1]).any():
+                order = np.argsort(flat, kind='stable')
+                flat, old, new = flat[order], old[order], new[order]
+        return cls.from_flat(flat, old, new, width)
+
+    @property
+    def size(self):
+        return self.old.size
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.lengths.nbytes + self.old.nbytes + np.asarray(self.new).nbytes
+
+    def indices(self):
+        return run_indices(self.starts, self.lengths)
+
+    def write(self, model, undo):
+        """Restore the old cells or write the new ones again, return the changed rectangles"""
+        values = self.old if undo else self.new
+        cells = model.data.ravel()
+        if self.size >= SLICE_RUN_LENGTH * self.starts.size:
+            offsets = np.cumsum(self.lengths) - self.lengths
+            uniform = np.ndim(values) == 0
+            for start, length, offset in zip(self.starts.tolist(), self.lengths.tolist(), offsets.tolist()):
+                cells[start:start + length] = values if uniform else values[offset:offset + length]
+        else:
+            cells[self.indices()] = values
+        rows, starts = np.divmod(self.starts, model.width)
+        model.dirty_rows[rows] = True
+        return span_rects(rows, starts, starts + self.lengths)
+
+    def cells(self, undo):
+        """The cells write puts in place, as a part of a 'cells' operation"""
+        return {'starts': self.starts, 'lengths': self.lengths, 'values': self.old if undo else self.new}
+
+
+class Edit(object):
+    """Parts changed by one user operation, in the order they were written"""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.nbytes = sum(part.nbytes for part in parts)
+
+    def write(self, model, undo):
+        """Restore the old cells or write the new ones again, return the changed rectangles"""
+        rects = []
+        for part in reversed(self.parts) if undo else self.parts:
+            rects.extend(part.write(model, undo))
+        return rects
+
+    def cells(self, undo):
+        """Parts of a 'cells' operation that writes the same cells as write"""
+        return [part.cells(undo) for part in (reversed(self.parts) if undo else self.parts)]
+
+
+class History(object):
+    """Undo and redo stacks of compact edits applied to one MapModel
+
+    An edit too large for `max_bytes` on its own cannot be undone.  The
+    older edits are dropped with it, since undoing them past it would mix
+    states, and `lost` counts such edits so the editor can tell the user.
+    """
+
+    def __init__(self, model, max_bytes=256 * 1024 * 1024):
+        self.model = model
+        self.max_bytes = max_bytes
+        self.undo_stack = []
+        self.redo_stack = []
+        self.nbytes = 0
+        self.depth = 0
+        self.pending = []
+        self.lost = 0
+
+    def begin(self):
+        """Start grouping the following writes into one undoable edit"""
+        self.depth += 1
+
+    def end(self):
+        """Close a group opened by begin, pushing its edit once the outermost group ends"""
+        self.depth -= 1
+        if self.depth == 0 and self.pending:
+            self.push(self.pending)
+            self.pending = []
+
+    def add(self, part):
+        """Add a recorded part to the open group or push it as an edit of its own"""
+        if self.depth:
+            self.pending.append(part)
+        else:
+            self.push([part])
+
+    def record(self, flat, old, new):
+        """Record scattered cells about to be written, before the model changes them"""
+        changed = old != new
+        if changed.any():
+            self.add((flat[changed], old[changed], new[changed]))
+
+    def record_rect(self, x, y, view, val):
+        """Record a rectangular fill of `view`, the slice of the map at (x, y)"""
+        runs = changed_runs(view, np.uint8(val), x, y, self.model.width)
+        if runs is not None:
+            starts, lengths, old, _ = runs
+            self.add(Cells(starts, lengths, old, np.uint8(val)))
+
+    def record_block(self, x, y, view, block):
+        """Record `view`, the slice of the map at (x, y), being replaced by `block`"""
+        runs = changed_runs(view, block, x, y, self.model.width)
+        if runs is not None:
+            self.add(Cells(*runs))
+
+    def record_cells(self, flat, val):
+        """Record a write of `val` to the cells with the given flat indices"""
+        old = self.model.data.ravel()[flat]
+        self.record(flat, old, np.broadcast_to(np.asarray(val, dtype=np.uint8), old.shape))
+
+    def push(self, parts):
+        """Turn recorded parts into one edit and put it on the undo stack"""
+        merged = []
+        cells = []
+        for part in parts:
+            if isinstance(part, tuple):
+                cells.append(part)
+                continue
+            # runs of scattered writes, such as the dabs of a stroke, become one part
+            if cells:
+                merged.append(Cells.merge(cells, self.model.width))
+                cells = []
+            merged.append(part)
+        if cells:
+            merged.append(Cells.merge(cells, self.model.width))
+
+        edit = Edit(merged)
+        self.clear_redo()
+        if edit.nbytes > self.max_bytes:
+            self.clear()
+            self.lost += 1
+            return
+        self.undo_stack.append(edit)
+        self.nbytes += edit.nbytes
+        self.evict()
+
+    def clear_redo(self):
+        self.nbytes -= sum(edit.nbytes for edit in self.redo_stack)
+        self.redo_stack = []
+
+    def evict(self):
+        """Drop the oldest edits until the history fits into max_bytes"""
+        while self.nbytes > self.max_bytes and self.undo_stack:
+            self.nbytes -= self.undo_stack.pop(0).nbytes
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        """Restore the cells of the last edit, return the rectangles it changed or None"""
+        if not self.undo_stack:
+            return None
+        edit = self.undo_stack.pop()
+        self.redo_stack.append(edit)
+        return edit.write(self.model, undo=True)
+
+    def redo(self):
+        """Reapply the last undone edit, return the rectangles it changed or None"""
+        if not self.redo_stack:
+            return None
+        edit = self.redo_stack.pop()
+        self.undo_stack.append(edit)
+        return edit.write(self.model, undo=False)
+
+    def cells(self, undo):
+        """The cells the last undo, or with `undo` false the last redo, wrote as a 'cells' operation"""
+        edit = self.redo_stack[-1] if undo else self.undo_stack[-1]
+        return {'op': 'cells', 'parts': edit.cells(undo)}
+
+    def clear(self):
+        self.undo_stack = []
+        self.redo_stack = []
+        self.pending = []
+        self.nbytes = 0
@@ -0,0 +1,237 @@
+"""
+Crash recovery journal of map edits.
+
+Every edit made in the editor is appended to a hidden file next to the map
+as the operation that made it, in the dicts apply_operation takes, so a
+crash or a kill loses nothing that was drawn.  The GUI thread only queues
+operations, a background thread writes them in batches, each batch as one
+zlib compressed frame behind its length.  A freehand stroke is a single
+operation however many cells it paints, and a frame cut short by a crash is
+ignored when reading.
+
+When a save is requested the journal so far is set aside and deleted once
+the save succeeded, so what is left after a crash are exactly the edits
+missing from the map file.  The editor offers to replay them the next time
+the map is opened.
+"""
+
+import json
+import os
+import struct
+import threading
+import zlib
+
+from ros_map_editor.core import apply_operation, encode_array
+
+# frame header: length of the compressed batch
+FRAME = struct.Struct('>I')
+
+
+def journal_file(fn):
+    """Name of the journal of a map file"""
+    directory, name = os.path.split(fn)
+    return os.path.join(directory, '.' + name + '.journal')
+
+
+def journal_files(fn):
+    """Journal files of a map in replay order, the part set aside for a running save first"""
+    path = journal_file(fn)
+    return [path + '.saving', path]
+
+
+def read_frames(path):
+    """Return the operations stored in one journal file and the length of its intact frames"""
+    ops = []
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return ops, 0
+    offset = 0
+    while offset + FRAME.size <= len(data):
+        size, = FRAME.unpack_from(data, offset)
+        end = offset + FRAME.size + size
+        if end > len(data):
+            break
+        try:
+            lines = zlib.decompress(data[offset + FRAME.size:end]).decode('utf-8').splitlines()
+            ops.extend(json.loads(line) for line in lines)
+        except (zlib.error, ValueError):
+            break
+        offset = end
+    return ops, offset
+
+
+def read_journal(fn):
+    """Return the journaled operations of a map that are not in its file yet"""
+    ops = []
+    for path in journal_files(fn):
+        ops.extend(read_frames(path)[0])
+    return ops
+
+
+def remove_journal(fn):
+    """Delete the journal of a map"""
+    for path in journal_files(fn):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def replay(doc, ops, history=None):
+    """Apply journaled operations to a MapDocument, return the rectangle of the map they changed
+
+    Each operation becomes one undoable edit of `history` when one is given.
+    Undo and redo steps are journaled as the cells they restored, so they
+    replay correctly even when the edit they reverted was saved already.
+    """
+    model = doc.model
+    previous = model.history
+    model.history = history
+    changed = False
+    try:
+        for op in ops:
+            if history is not None:
+                history.begin()
+            try:
+                changed = apply_operation(doc, op) is not None or changed
+            finally:
+                if history is not None:
+                    history.end()
+    finally:
+        model.history = previous
+    return (0, 0, model.width, model.height) if changed else None
+
+
+class Journal(object):
+    """Append-only journal of the edits of one map, written by a background thread"""
+
+    # operations queued within this many seconds are written as one frame
+    FLUSH_SECONDS = 0.5
+
+    def __init__(self, fn):
+        self.path = journal_file(fn)
+        self.saving = self.path + '.saving'
+        # operations and actions such as set_aside, in the order they were queued
+        self.queue = []
+        self.urgent = False
+        self.closed = False
+        self.failed = False
+        # saves requested whose outcome is not known yet
+        self.pending_saves = 0
+        self.cond = threading.Condition()
+        self.repair()
+        self.thread = threading.Thread(target=self.run, name='journal', daemon=True)
+        self.thread.start()
+
+    def add(self, op):
+        """Queue one operation, a dict as taken by apply_operation"""
+        with self.cond:
+            self.queue.append(op)
+            self.cond.notify()
+
+    def call(self, action):
+        """Run an action on the writer thread once everything queued before it is written"""
+        with self.cond:
+            self.queue.append(action)
+            self.urgent = True
+            self.cond.notify()
+
+    def checkpoint(self):
+        """A save of the map was requested, the edits so far will be in the map file"""
+        self.pending_saves += 1
+        self.call(self.set_aside)
+
+    def saved(self, ok):
+        """A save finished, the journal set aside for it is not needed after a success"""
+        self.pending_saves -= 1
+        # a later save that is still running may fail and need the older edits too
+        if ok and not self.pending_saves:
+            self.call(lambda: self.remove(self.saving))
+
+    def discard(self):
+        """Forget every journaled edit, the map goes back to its file"""
+        with self.cond:
+            self.queue = []
+        self.call(lambda: (self.remove(self.saving), self.remove(self.path)))
+
+    def close(self):
+        """Write what is queued and stop the writer thread"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+    def run(self):
+        """Writer thread, gathers queued operations into frames"""
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue or self.closed)
+                # give a burst of edits the chance to end up in one frame
+                self.cond.wait_for(lambda: self.urgent or self.closed, self.FLUSH_SECONDS)
+                queue, self.queue = self.queue, []
+                self.urgent = False
+                closed = self.closed
+
+            batch = []
+            for item in queue:
+                if callable(item):
+                    self.write(batch)
+                    batch = []
+                    item()
+                else:
+                    batch.append(item)
+            self.write(batch)
+            if closed:
+                return
+
+    def write(self, ops):
+        """Append one frame with the given operations"""
+        if not ops:
+            return
+        data = zlib.compress('\n'.join(json.dumps(op, separators=(',', ':'), default=encode_array)
+                                       for op in ops).encode('utf-8'))
+        try:
+            with open(self.path, 'ab') as f:
+                f.write(FRAME.pack(len(data)) + data)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            # report once, the editor keeps working without recovery
+            if not self.failed:
+                print("ERROR:  Cannot write journal", self.path, "-", e)
+            self.failed = True
+
+    def repair(self):
+        """Cut off a frame a crash left unfinished, frames appended after it would be unreadable"""
+        for path in (self.saving, self.path):
+            if not os.path.exists(path):
+                continue
+            length = read_frames(path)[1]
+            try:
+                if length < os.path.getsize(path):
+                    with open(path, 'r+b') as f:
+                        f.truncate(length)
+            except OSError as e:
+                print("ERROR:  Cannot repair journal", path, "-", e)
+
+    def set_aside(self):
+        """Move the journal so far next to the part a running save already covers"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            if os.path.exists(self.saving):
+                with open(self.path, 'rb') as src, open(self.saving, 'ab') as dst:
+                    dst.write(src.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.saving)
+        except OSError as e:
+            print("ERROR:  Cannot rotate journal", self.path, "-", e)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,87 @@
+"""
+Background loading of maps.
+
+The image is read and validated together with its YAML file on a worker
+thread, which also builds the downsampled levels the minimap is drawn
+from, so opening a large map never blocks the GUI.  Progress is reported
+through a callback as the levels are built and a load can be cancelled,
+the worker then stops at the next band of rows.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ros_map_editor.core import MapDocument
+from ros_map_editor.profiling import profiler
+from ros_map_editor.pyramid import MapPyramid, fit_level
+
+
+class LoadCancelled(Exception):
+    """Raised on the worker thread when a load was cancelled"""
+
+
+class LoadTask(object):
+    """One requested load, the handle the GUI keeps to cancel it"""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise LoadCancelled(self.fn)
+
+
+class MapLoader(object):
+    """Loads maps into MapDocument and MapPyramid objects on a worker thread"""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def load(self, fn, fit, progress=None, callback=None):
+        """Load `fn` in the background and build the pyramid levels down to `fit` cells
+
+        `progress(task, fraction)` and `callback(task, result, error)` are
+        always called from the worker thread, never from inside load, so the
+        caller has the task before it hears of it.  The result is a (document,
+        pyramid) tuple, the error a MapLoadError, LoadCancelled or any other
+        exception the load raised.  Returns the LoadTask.
+        """
+        task = LoadTask(fn)
+        task.future = self.executor.submit(self.finish, task, fit, progress, callback)
+        return task
+
+    def finish(self, task, fit, progress=None, callback=None):
+        """Run one load and report how it ended, on the worker thread"""
+        try:
+            result = self.run(task, fit, progress)
+        except Exception as error:
+            if callback is not None:
+                callback(task, None, error)
+            return
+        if callback is not None:
+            callback(task, result, None)
+
+    def run(self, task, fit, progress=None):
+        """Body of one load on the worker thread"""
+        task.check()
+        with profiler.span('load'):
+            document = MapDocument.load(task.fn)
+            task.check()
+            pyramid = MapPyramid.load(document.model.data, document.fn)
+            model = document.model
+            for fraction in pyramid.build(fit_level(model.width, model.height, fit)):
+                task.check()
+                if progress is not None:
+                    progress(task, fraction)
+        return document, pyramid
+
+    def shutdown(self, tasks=()):
+        """Cancel the given tasks and wait for the worker to finish"""
+        for task in tasks:
+            task.cancel()
+        self.executor.shutdown(wait=True)
@@ -3,25 +3,65 @@
 Main entry point for the ROS Map Editor application.
 """
 
+import atexit
+import os
 import sys
 import argparse
-from ros_map_editor.map_editor import MapEditor
 from ros_map_editor import __version__
-from PyQt5 import QtWidgets
+from ros_map_editor import profiling
+
+
+def dump_profile(fn):
+    """Write the collected timings when the editor exits"""
+    try:
+        profiling.profiler.dump(fn)
+        print(f"Profile written to {fn}")
+    except OSError as e:
+        print(f"ERROR:  Cannot write profile {fn}: {e}")
 
 
 def main():
     """
     Main function that parses command line arguments and starts the application.
     """
-    print("Starting ROS Map Editor...")
-    parser = argparse.ArgumentParser(description='ROS Map Editor - A GUI tool for editing ROS map files')
-    parser.add_argument('map_file', help='Path to the map file (.pgm or without extension)')
+    # the batch subcommand runs headless, keep Qt out of its way
+    if sys.argv[1:2] == ['batch']:
+        from ros_map_editor import batch
+        sys.exit(batch.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['pyramid']:
+        from ros_map_editor import pyramid
+        sys.exit(pyramid.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['benchmark']:
+        from ros_map_editor import benchmark
+        sys.exit(benchmark.main(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description='ROS Map Editor - A GUI tool for editing ROS map files',
+                                     epilog='Run "%(prog)s batch --help" to edit maps without a display and '
+                                            '"%(prog)s pyramid --help" to export downsampled maps.')
+    parser.add_argument('map_file', nargs='?',
+                        help='Path to the map file (.pgm or without extension), File > Open picks one otherwise')
     parser.add_argument('--version', action='version', version=f'%(prog)s {__version__}')
-    
+    parser.add_argument('--profile', nargs='?', metavar='FILE', const='1',
+                        default=os.environ.get(profiling.ENV_VAR),
+                        help='Time the editor, show the timings on the map and write them to FILE on exit '
+                             f'(default {profiling.DEFAULT_FILE}, also set by ${profiling.ENV_VAR})')
+
     args = parser.parse_args()
-    print(f"Opening map file: {args.map_file}")
-    
+
+    # Qt and the editor are only imported once the arguments are known to be good,
+    # --help and --version return without loading them
+    print("Starting ROS Map Editor...")
+    from ros_map_editor.map_editor import MapEditor
+    from PyQt5 import QtWidgets
+
+    if args.map_file is not None:
+        print(f"Opening map file: {args.map_file}")
+
+    profile_file = profiling.output_file(args.profile)
+    if profile_file is not None:
+        profiling.profiler.enable()
+        atexit.register(dump_profile, profile_file)
+
     app = QtWidgets.QApplication(sys.argv)
     try:
         window = MapEditor(args.map_file)
@@ -35,4 +75,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,21 +1,62 @@
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 
 from ros_map_editor.ui_map_editor import Ui_MapEditor
+from ros_map_editor.map_layer import MapLayer, MapScene
+from ros_map_editor.core import COLOR_VALUES, MapLoadError, resolve_map_file
+from ros_map_editor.raster import thick_line, polygon_spans
+from ros_map_editor.brush import BrushStroke
+from ros_map_editor.minimap import Minimap
+from ros_map_editor.dirty import DirtyRegion
+from ros_map_editor.profiling import profiler
+from ros_map_editor.saving import MapSaver
+from ros_map_editor.loading import MapLoader, LoadCancelled
+from ros_map_editor.session import MapSession
+from ros_map_editor import journal
+from ros_map_editor.history import History
+from ros_map_editor.map_model import class_lut, UNKNOWN, OCCUPIED
+from ros_map_editor import filters
 from ros_map_editor import __version__
 
 from PyQt5.QtGui import QPainter, QBrush, QPen
 from PyQt5.QtCore import Qt
 
 import math
-import yaml
-from PIL import Image
-import sys
+import numpy as np
 import os
+import sys
 
 
 class MapEditor(QtWidgets.QMainWindow):
-    def __init__(self, fn):
-        """Initialize the map editor with the given map file"""
+    # zoom factor per mouse wheel notch and the allowed on-screen cell sizes
+    WHEEL_ZOOM_STEP = 1.25
+    MIN_PIXELS_PER_CELL = 1.0 / 64
+    MAX_PIXELS_PER_CELL = 128
+    # edits are pushed to the display at most once per frame
+    FRAME_INTERVAL_MS = 16
+
+    # default size below which occupied blobs are removed by despeckle
+    DESPECKLE_MIN_CELLS = 10
+
+    # display colors of the FREE, UNKNOWN and OCCUPIED classes
+    CLASS_COLORS = (Qt.white, Qt.gray, Qt.black)
+    # palette showing the raw cell values
+    GRAY_PALETTE = [QtGui.qRgb(val, val, val) for val in range(256)]
+
+    # refresh interval of the profiling overlay
+    PROFILE_OVERLAY_MS = 250
+
+    # memory cap of the undo history
+    HISTORY_LIMIT_BYTES = 256 * 1024 * 1024
+    # memory cap of the maps kept loaded, the least recently shown ones are evicted
+    SESSION_LIMIT_BYTES = 2 * 1024 * 1024 * 1024
+
+    # emitted from the saver thread, delivered on the GUI thread
+    saveFinished = QtCore.pyqtSignal(object, object)
+    loadProgress = QtCore.pyqtSignal(object, float)
+    loadFinished = QtCore.pyqtSignal(object, object, object)
+
+    def __init__(self, fn=None):
+        """Initialize the map editor and start loading the given map file"""
         super(MapEditor, self).__init__()
 
         # two approaches to integrating tool generated ui file shown below
@@ -43,47 +84,178 @@ class MapEditor(QtWidgets.QMainWindow):
         self.ui.colorBox.currentIndexChanged.connect(self.handleColor)
         self.color = 'alternate'
 
+        self.ui.connectivityBox.addItem('4-connected', 4)
+        self.ui.connectivityBox.addItem('8-connected', 8)
+
         self.box_selecting = False
         self.line_selecting = False
         self.box_select_mode = False
         self.line_select_mode = False
+        self.polygon_select_mode = False
+        self.flood_fill_mode = False
+        self.polygon_points = []
         self.start_pos = None
         self.end_pos = None
-
-        self.read(fn)
-
-        view_width = self.frameGeometry().width()
-
-        self.min_multiplier = math.ceil(view_width / self.map_width_cells)
+        # last box selection as (x, y, width, height), filters work on it
+        self.selection = None
+        self.despeckle_min_cells = self.DESPECKLE_MIN_CELLS
+
+        self.thresholds = None
+        self.grayscale = False
+
+        self.stroke = None
+        # changed cells are collected here and repainted together on the next frame
+        self.dirty = DirtyRegion(MapLayer.TILE_SIZE)
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setInterval(self.FRAME_INTERVAL_MS)
+        self.frame_timer.timeout.connect(self.paintFrame)
+
+        # the maps of the session, the shown one is mirrored by the attributes below
+        self.session = MapSession(self.SESSION_LIMIT_BYTES)
+        self.current = None
+        # the map asked for last, shown as soon as its load finishes
+        self.pending = None
+        self.fn = None
+        self.document = None
+        self.model = None
+        self.history = None
+        self.pyramid = None
+        self.scene = None
+        self.layer = None
+        self.minimap = None
+        self.min_multiplier = 1
         self.zoom = 1
-        self.pixels_per_cell = self.min_multiplier * self.zoom 
+        self.pixels_per_cell = 1
+
+        self.mapTabs = QtWidgets.QTabBar()
+        self.mapTabs.setTabsClosable(True)
+        self.mapTabs.setExpanding(False)
+        self.mapTabs.setDocumentMode(True)
+        self.mapTabs.currentChanged.connect(self.switchMap)
+        self.mapTabs.tabBarClicked.connect(self.retryMap)
+        self.mapTabs.tabCloseRequested.connect(self.closeMap)
+        self.ui.verticalLayout.insertWidget(0, self.mapTabs)
+
+        self.loader = MapLoader()
+        self.loadProgress.connect(self.handleLoadProgress)
+        self.loadFinished.connect(self.handleLoaded)
+        self.progress = QtWidgets.QProgressBar()
+        self.progress.setRange(0, 100)
+        self.progress.setMaximumWidth(160)
+        self.ui.statusbar.addPermanentWidget(self.progress)
+        self.cancelButton = QtWidgets.QToolButton()
+        self.cancelButton.setText('Cancel')
+        self.cancelButton.clicked.connect(self.cancelLoad)
+        self.ui.statusbar.addPermanentWidget(self.cancelButton)
+        self.progress.hide()
+        self.cancelButton.hide()
 
-        self.draw_map()
-        
         self.ui.boxSelectCheck.stateChanged.connect(self.toggleBoxSelect)
         self.ui.lineSelectCheck.stateChanged.connect(self.toggleLineSelect)
+        self.ui.polygonSelectCheck.stateChanged.connect(self.togglePolygonSelect)
+        self.ui.floodFillCheck.stateChanged.connect(self.toggleFloodFill)
 
         self.ui.focusButton.clicked.connect(self.centerView)
 
         self.ui.closeButton.clicked.connect(self.closeEvent)
         self.ui.saveButton.clicked.connect(self.saveEvent)
 
+        self.saver = MapSaver()
+        self.saveFinished.connect(self.handleSaved)
+
+        file_menu = self.ui.menubar.addMenu('&File')
+        file_menu.addAction('&Open...', self.openFile, QtGui.QKeySequence.Open)
+
+        edit_menu = self.ui.menubar.addMenu('&Edit')
+        self.undoAction = edit_menu.addAction('&Undo', self.undo, QtGui.QKeySequence.Undo)
+        self.redoAction = edit_menu.addAction('&Redo', self.redo, QtGui.QKeySequence.Redo)
+
+        view_menu = self.ui.menubar.addMenu('&View')
+        self.grayscaleAction = view_menu.addAction('Show &Raw Values')
+        self.grayscaleAction.setCheckable(True)
+        self.grayscaleAction.toggled.connect(self.setGrayscale)
+
+        filter_menu = self.ui.menubar.addMenu('F&ilters')
+        filter_menu.addAction('&Despeckle...', self.despeckle)
+        for op in filters.MORPHOLOGY:
+            action = filter_menu.addAction(op.capitalize())
+            action.triggered.connect(lambda checked, op=op: self.morphology(op))
+        filter_menu.addAction('&Requantize', self.requantize)
+        filter_menu.addSeparator()
+        filter_menu.addAction('Clear &Selection', self.clearSelectionRect)
+        # editing needs a map, these stay disabled until the first one is loaded; the
+        # tab bar and the Close button stay usable so a failed load never locks the window
+        controls = self.ui.controls_group.findChildren(QtWidgets.QWidget, options=Qt.FindDirectChildrenOnly)
+        self.map_widgets = ([self.ui.graphicsView, self.ui.image_preview_group, self.ui.info_group] +
+                            [widget for widget in controls if widget is not self.ui.closeButton] +
+                            edit_menu.actions() + filter_menu.actions())
+
         self.ui.graphicsView.horizontalScrollBar().valueChanged.connect(self.scrollChanged)
         self.ui.graphicsView.verticalScrollBar().valueChanged.connect(self.scrollChanged)
 
+        self.ui.graphicsView.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
         self.ui.graphicsView.setMouseTracking(True)
         self.ui.graphicsView.viewport().installEventFilter(self)
 
+        for widget in self.map_widgets:
+            widget.setEnabled(False)
+
+        if profiler.enabled:
+            self.setupProfiling()
+
+        if fn is not None:
+            self.openMap(fn)
+
 
+    @profiler.timed('eventFilter', frequent=True)
     def eventFilter(self, source, event):
         """handle mouse interactions including box selection mode"""
+        if self.layer is None:
+            return super().eventFilter(source, event)
+
+        # mouse wheel zooms freely around the cursor
+        if event.type() == QtCore.QEvent.Wheel:
+            steps = event.angleDelta().y() / 120.0
+            self.setZoom(self.pixels_per_cell * self.WHEEL_ZOOM_STEP ** steps)
+            return True
+
+        # flood fill mode: a left click fills the region under the cursor
+        if self.flood_fill_mode and event.type() == QtCore.QEvent.MouseButtonPress:
+            if event.button() == Qt.LeftButton:
+                pos = self.ui.graphicsView.mapToScene(event.pos())
+                self.floodFill(math.floor(pos.x()), math.floor(pos.y()))
+            return True
+
+        # dragging in flood fill mode must not paint a brush stroke
+        if self.flood_fill_mode and event.type() == QtCore.QEvent.MouseMove:
+            return True
+
+        # polygon mode: left clicks add vertices, a double or right click closes the polygon
+        if self.polygon_select_mode and event.type() == QtCore.QEvent.MouseButtonPress:
+            if event.button() == Qt.RightButton:
+                self.fillPolygon()
+            elif event.button() == Qt.LeftButton:
+                pos = self.ui.graphicsView.mapToScene(event.pos())
+                self.polygon_points.append((math.floor(pos.x()), math.floor(pos.y())))
+                self.updatePolygonPreview()
+            return True
+
+        if self.polygon_select_mode and event.type() == QtCore.QEvent.MouseButtonDblClick:
+            self.fillPolygon()
+            return True
+
         # mouse movement event handling
         if event.type() == QtCore.QEvent.MouseMove:
-            pos = event.pos()
-            x = pos.x() + self.ui.graphicsView.horizontalScrollBar().value()
-            y = pos.y() + self.ui.graphicsView.verticalScrollBar().value()
-            cell_x = math.floor(x / self.pixels_per_cell)
-            cell_y = math.floor(y / self.pixels_per_cell)
+            # the scene is in cell coordinates, the view transform does the zoom
+            pos = self.ui.graphicsView.mapToScene(event.pos())
+            cell_x = math.floor(pos.x())
+            cell_y = math.floor(pos.y())
+
+            # rubber band edge from the last polygon vertex to the cursor
+            if self.polygon_select_mode and self.polygon_points:
+                self.updatePolygonPreview((cell_x, cell_y))
+                return True
             
             # line selection mode processing
             if self.ui.lineSelectCheck.isChecked() and event.buttons() == QtCore.Qt.LeftButton:
@@ -105,7 +277,7 @@ class MapEditor(QtWidgets.QMainWindow):
                 
             # normal mode processing
             elif event.buttons() == QtCore.Qt.LeftButton and self.color != 'alternate':
-                self.fillCell(cell_x, cell_y)
+                self.strokeTo(cell_x, cell_y)
                 return True
         
         elif event.type() == QtCore.QEvent.MouseButtonRelease and self.line_selecting:
@@ -117,43 +289,42 @@ class MapEditor(QtWidgets.QMainWindow):
         # mouse release event handling
         elif event.type() == QtCore.QEvent.MouseButtonRelease and self.box_selecting:
             self.box_selecting = False
-            self.fillSelectedArea()
-            self.clearSelectionRect()
+            if self.fill_value() is None:
+                # without a fixed color the box only selects the area filters work on
+                self.selection = self.model.clip_rect(self.start_pos[0], self.start_pos[1],
+                                                      self.end_pos[0], self.end_pos[1])
+            else:
+                self.fillSelectedArea()
+                self.clearSelectionRect()
+            return True
+
+        elif event.type() == QtCore.QEvent.MouseButtonRelease and self.stroke is not None:
+            self.endStroke()
             return True
             
         return super().eventFilter(source, event)
 
-    def paintEvent(self, e):
-        """Handle paint events by updating the scroll position"""
-        self.scrollChanged(0)
+    def resizeEvent(self, event):
+        """Keep the minimap box in sync with the resized view"""
+        super().resizeEvent(event)
+        if getattr(self, 'minimap', None) is not None:
+            self.scrollChanged(0)
 
 
     def scrollChanged(self, val):
         """Update the minimap view when scrolling the main view"""
         
-        if self.scene.width() and self.scene.height():
-            x = int(self.ui.graphicsView.horizontalScrollBar().value() /  self.scene.width() * self.im.size[0])
-            y = int(self.ui.graphicsView.verticalScrollBar().value() /  self.scene.height() * self.im.size[1])
-            width = int(self.ui.graphicsView.viewport().size().width() /  self.scene.width() * self.im.size[0])
-            height = int(self.ui.graphicsView.viewport().size().height() /  self.scene.height() * self.im.size[1])
-            self.drawBox(x, y, width, height)
+        if self.minimap is not None and self.scene.width() and self.scene.height():
+            view = self.ui.graphicsView
+            visible = view.mapToScene(view.viewport().rect()).boundingRect()
+            self.drawBox(int(visible.x()), int(visible.y()), int(visible.width()), int(visible.height()))
 
 
+    @profiler.timed('drawBox', frequent=True)
     def drawBox(self, x=5, y=5, width=50, height=50):
         """Draw a red rectangle on the minimap to show current view position"""
-        im = self.im.convert("RGBA")
-        data = im.tobytes("raw","RGBA")
-        qim = QtGui.QImage(data, im.size[0], im.size[1], QtGui.QImage.Format_ARGB32)
-        pix = QtGui.QPixmap.fromImage(qim)
-
-        painter = QtGui.QPainter(pix)
-        pen = QPen(Qt.red)
-        pen.setWidth(1)
-        painter.setPen(pen)
-        painter.drawRect(x, y, width, height)
-
-        painter.end()
-
+        # the overview itself is cached, only the small box overlay is redrawn
+        pix = self.minimap.render(QtCore.QRectF(x, y, width, height))
         self.ui.label_2.setPixmap(pix)
         self.ui.label_2.show()
 
@@ -162,67 +333,339 @@ class MapEditor(QtWidgets.QMainWindow):
         self.color = self.ui.colorBox.currentText()
 
     def handleZoom(self, index):
-        """Update zoom level and redraw the map"""
+        """Update zoom level from the zoom box"""
         self.zoom = self.ui.zoomBox.currentData()
-        self.pixels_per_cell = self.min_multiplier * self.zoom 
-        self.draw_map()
+        self.setZoom(self.min_multiplier * self.zoom)
+
+    def setZoom(self, pixels_per_cell):
+        """Zoom by changing the view transform, the scene items stay untouched"""
+        pixels_per_cell = min(max(pixels_per_cell, self.MIN_PIXELS_PER_CELL), self.MAX_PIXELS_PER_CELL)
+        factor = pixels_per_cell / self.pixels_per_cell
+        self.pixels_per_cell = pixels_per_cell
+        self.ui.graphicsView.scale(factor, factor)
+        self.scrollChanged(0)
+
+        # the grid lines depend on the on-screen cell size
+        if self.scene is not None and self.scene.pixels_per_cell != pixels_per_cell:
+            self.scene.pixels_per_cell = pixels_per_cell
+            self.scene.update()
         
 
-    def read(self, fn):
-        """Load and parse map file (.pgm) and its corresponding YAML configuration"""
-        # try to open as fn or fn.pgm
+    def openFile(self):
+        """Pick a map in a file dialog and load it"""
+        directory = os.path.dirname(self.fn) if self.fn else ''
+        fn, _ = QtWidgets.QFileDialog.getOpenFileName(self, 'Open Map', directory, 'PGM maps (*.pgm);;All files (*)')
+        if fn:
+            self.openMap(fn)
+
+    def openMap(self, fn):
+        """Show a map, opening it in a new tab unless it is open already"""
+        try:
+            # one tab and one journal per file, whether it was named with its extension or not
+            fn = os.path.abspath(resolve_map_file(fn))
+        except MapLoadError as e:
+            print("ERROR: ", e)
+            QtWidgets.QMessageBox.warning(self, 'Open Map', str(e))
+            return
+        entry = self.session.find(fn)
+        if entry is None:
+            entry = self.session.add(fn)
+            self.mapTabs.blockSignals(True)
+            index = self.mapTabs.addTab(os.path.basename(fn))
+            self.mapTabs.setTabToolTip(index, fn)
+            self.mapTabs.blockSignals(False)
+            self.selectTab(self.current)
+        self.showEntry(entry)
+
+    def selectTab(self, entry):
+        """Mark the tab of the shown map as current without switching maps"""
+        if entry is not None:
+            self.mapTabs.blockSignals(True)
+            self.mapTabs.setCurrentIndex(self.session.entries.index(entry))
+            self.mapTabs.blockSignals(False)
+
+    def switchMap(self, index):
+        """Show the map of a tab the user picked"""
+        entry = self.session.entries[index]
+        if entry is not self.current:
+            self.showEntry(entry)
+            # the shown map stays current until the picked one has been loaded
+            self.selectTab(self.current)
+
+    def retryMap(self, index):
+        """Load the map of a clicked tab again when none is shown, as after its load failed"""
+        if self.current is None and self.pending is None and index >= 0:
+            self.switchMap(index)
+
+    def showEntry(self, entry):
+        """Show a map of the session, loading it on the loader thread unless it is still loaded"""
+        if self.pending is not None and self.pending is not entry and self.pending.task is not None:
+            # the map asked for before is no longer wanted, free the loader for this one
+            self.pending.task.cancel()
+        if entry.loaded:
+            self.pending = None
+            self.progress.hide()
+            self.cancelButton.hide()
+            if entry is not self.current:
+                self.activateMap(entry)
+            return
+        self.pending = entry
+        if entry.task is None or entry.task.cancelled.is_set():
+            # a load cancelled when another map was picked is started again
+            fit = self.ui.label_2.maximumSize()
+            entry.task = self.loader.load(entry.source(), min(fit.width(), fit.height()),
+                                          self.loadProgress.emit, self.loadFinished.emit)
+            self.progress.setValue(0)
+        self.progress.show()
+        self.cancelButton.show()
+        self.ui.statusbar.showMessage('Loading ' + entry.fn + ' ...')
+
+    def cancelLoad(self):
+        """Stop loading the map asked for last, the shown map stays"""
+        if self.pending is not None and self.pending.task is not None:
+            self.pending.task.cancel()
+
+    def handleLoadProgress(self, task, fraction):
+        """Show the progress of a load, called on the GUI thread"""
+        if self.pending is not None and task is self.pending.task:
+            self.progress.setValue(int(fraction * 100))
+
+    def handleLoaded(self, task, result, error):
+        """Show a loaded map or report why it failed, called on the GUI thread"""
+        entry = next((entry for entry in self.session.entries if entry.task is task), None)
+        if entry is None:
+            # closed while it was loading
+            return
+        entry.task = None
+        wanted = entry is self.pending
+        if wanted:
+            self.pending = None
+            self.progress.hide()
+            self.cancelButton.hide()
+
+        if error is not None:
+            if isinstance(error, LoadCancelled) and not wanted:
+                # another map was picked meanwhile, this one keeps its tab and loads when picked again
+                return
+            if isinstance(error, LoadCancelled):
+                self.ui.statusbar.showMessage('Loading ' + entry.fn + ' cancelled', 5000)
+            else:
+                print("ERROR: ", error)
+                self.ui.statusbar.showMessage('Loading ' + entry.fn + ' failed')
+                QtWidgets.QMessageBox.warning(self, 'Open Map', str(error))
+            # a map that was never shown has nothing left to keep its tab for
+            if not entry.evicted:
+                self.removeEntry(entry)
+            return
+
+        document, pyramid = result
+        if entry.spill is not None:
+            # loaded from the spill file, every cell may differ from the map file
+            document.fn = entry.fn
+            document.model.mark_rows(0, document.model.height)
+        entry.document = document
+        entry.pyramid = pyramid
+        entry.history = History(document.model, self.HISTORY_LIMIT_BYTES)
+        document.model.history = entry.history
+        if entry.journal is None:
+            self.recoverEdits(entry)
+            entry.journal = journal.Journal(entry.fn)
+        self.session.touch(entry)
+
+        if wanted:
+            self.ui.statusbar.clearMessage()
+            self.activateMap(entry)
+        else:
+            self.session.evict(keep=self.current)
+
+    @profiler.timed('recoverEdits')
+    def recoverEdits(self, entry):
+        """Offer to replay the edits a crash or an unsaved exit left in the journal of a freshly loaded map"""
+        ops = journal.read_journal(entry.fn)
+        if not ops:
+            return
+        answer = QtWidgets.QMessageBox.question(
+            self, 'Recover Edits', '%s has %d edits from an earlier session that were never saved. '
+                                   'Replay them?' % (entry.fn, len(ops)))
+        if answer != QtWidgets.QMessageBox.Yes:
+            journal.remove_journal(entry.fn)
+            return
         try:
-            self.im = Image.open(fn)
-            self.fn = fn
-        except:
-            fnpgm = fn + '.pgm'
-            print(fnpgm)
-            try:
-                self.im = Image.open(fnpgm)
-                self.fn = fnpgm
-            except:
-                #print(sys.exc_info()[0])
-                print("ERROR:  Cannot open file", fn, "or", fnpgm)
-                sys.exit(1)
-
-        if self.im.format != 'PPM':
-            print("ERROR:  This is not a PGM formatted file.")
-            sys.exit(1)
-
-        if self.im.mode != 'L':
-            print("ERROR:  This PGM file is not of mode L.")
-            sys.exit(1)   
-
-        self.map_width_cells = self.im.size[0]
-        self.map_height_cells = self.im.size[1]
+            rect = journal.replay(entry.document, ops, entry.history)
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            # the edits before the broken one stay, they can be undone
+            print("ERROR:  Cannot replay the journal of", entry.fn, "-", e)
+            QtWidgets.QMessageBox.warning(self, 'Recover Edits', 'Replaying stopped at a broken edit: %s' % e)
+            rect = (0, 0, entry.model.width, entry.model.height)
+        if rect is not None:
+            # the levels were built from the map file before the replay
+            entry.pyramid.update(*rect)
+
+    def logEdit(self, op):
+        """Append an edit of the shown map to its journal, in the form apply_operation takes"""
+        if self.current is not None and self.current.journal is not None:
+            self.current.journal.add(op)
+
+    @profiler.timed('activateMap')
+    def activateMap(self, entry):
+        """Show a loaded map, with the scene and view position it had when it was last shown"""
+        if self.current is not None and self.current is not entry:
+            self.storeView()
+        self.current = entry
+        self.session.touch(entry)
+        self.selectTab(entry)
+
+        self.document = entry.document
+        # binary pixels are memory-mapped copy-on-write, edits stay private until saved
+        self.fn = self.document.fn
+        self.model = self.document.model
+        self.history = entry.history
+        self.pyramid = entry.pyramid
+        self.scene = entry.scene
+        self.layer = entry.layer
+        self.minimap = entry.minimap
+        self.map_width_cells = self.model.width
+        self.map_height_cells = self.model.height
 
         self.ui.filename_lbl.setText(self.fn) 
         self.ui.width_lbl.setText(str(self.map_width_cells))
         self.ui.height_lbl.setText(str(self.map_height_cells))
 
-        fn_yaml = os.path.splitext(fn)[0] + '.yaml'
-        try:
-            stream = open(fn_yaml, "r")
-            docs = yaml.load_all(stream, Loader=yaml.FullLoader)
-            for doc in docs:
-                self.occupied_thresh = doc['occupied_thresh']  # probability its occupied
-                self.free_thresh = doc['free_thresh']  # probability its uncertain or occupied
-                self.resolution = doc['resolution']    # in meters per cell
-                self.origin_x = doc['origin'][0]
-                self.origin_y = doc['origin'][1]
-        except:
-            print("ERROR:  Corresponding YAML file", fn_yaml, "is missing or incorrectly formatted.")
-            sys.exit(1)
+        self.setThresholds(self.document.occupied_thresh,  # probability its occupied
+                           self.document.free_thresh)  # probability its uncertain or occupied
+        self.resolution = self.document.resolution    # in meters per cell
+        self.origin_x = self.document.origin[0]
+        self.origin_y = self.document.origin[1]
+
+        view = self.ui.graphicsView
+        if entry.scene is None:
+            view_width = self.frameGeometry().width()
+
+            self.min_multiplier = math.ceil(view_width / self.map_width_cells)
+            self.zoom = 1
+            self.pixels_per_cell = self.min_multiplier * self.zoom
+            self.selection = None
+
+            self.draw_map()
+            entry.scene = self.scene
+            entry.layer = self.layer
+            entry.minimap = self.minimap
+        else:
+            state = entry.view
+            self.min_multiplier = state['min_multiplier']
+            self.zoom = state['zoom']
+            self.pixels_per_cell = state['pixels_per_cell']
+            self.selection = state['selection']
+            self.selection_rect, self.line_preview, self.polygon_preview = state['previews']
+
+            view.setScene(self.scene)
+            view.setTransform(QtGui.QTransform.fromScale(self.pixels_per_cell, self.pixels_per_cell))
+            view.centerOn(state['center'])
+            # the palette may have changed while another map was shown
+            if self.layer.color_table is not self.color_table():
+                self.updatePalette()
+
+        self.ui.zoomBox.blockSignals(True)
+        self.ui.zoomBox.setCurrentIndex(max(0, self.ui.zoomBox.findData(self.zoom)))
+        self.ui.zoomBox.blockSignals(False)
+        for widget in self.map_widgets:
+            widget.setEnabled(True)
+        self.updateUndoActions()
+        self.scrollChanged(0)
+
+        self.session.evict(keep=entry)
+
+    def storeView(self):
+        """Finish pending edits of the shown map and remember how it is shown"""
+        self.endStroke()
+        self.paintFrame()
+        self.frame_timer.stop()
+        self.box_selecting = self.line_selecting = False
+        self.clearLinePreview()
+        self.clearPolygonPreview()
+
+        view = self.ui.graphicsView
+        self.current.view = {
+            'min_multiplier': self.min_multiplier,
+            'zoom': self.zoom,
+            'pixels_per_cell': self.pixels_per_cell,
+            'center': view.mapToScene(view.viewport().rect().center()),
+            'selection': self.selection,
+            'previews': (self.selection_rect, self.line_preview, self.polygon_preview),
+        }
+
+    def closeMap(self, index):
+        """Close the map of a tab, asking first if it has unsaved edits"""
+        entry = self.session.entries[index]
+        if entry.unsaved():
+            answer = QtWidgets.QMessageBox.question(self, 'Close Map',
+                                                    'Discard the unsaved changes to ' + entry.fn + '?')
+            if answer != QtWidgets.QMessageBox.Yes:
+                return
+            if entry.journal is not None:
+                entry.journal.discard()
+        if entry.task is not None:
+            entry.task.cancel()
+        self.removeEntry(entry)
+
+    def removeEntry(self, entry):
+        """Drop a map from the session and its tab, showing a neighbour if it was the shown one"""
+        index = self.session.entries.index(entry)
+        if entry is self.pending:
+            self.pending = None
+            self.progress.hide()
+            self.cancelButton.hide()
+        if entry is self.current:
+            self.endStroke()
+            self.frame_timer.stop()
+            self.dirty.take()
+            self.current = None
+        self.session.remove(entry)
+        self.mapTabs.blockSignals(True)
+        self.mapTabs.removeTab(index)
+        self.mapTabs.blockSignals(False)
+
+        if self.current is not None:
+            self.selectTab(self.current)
+            return
+        # nothing may edit the closed map while a neighbour is loaded
+        self.clearMap()
+        if self.session.entries:
+            self.showEntry(self.session.entries[min(index, len(self.session) - 1)])
+
+    def clearMap(self):
+        """Show no map at all, after the shown one was closed"""
+        self.fn = self.document = self.model = self.history = None
+        self.pyramid = self.scene = self.layer = self.minimap = None
+        self.selection = None
+        self.box_selecting = self.line_selecting = False
+        self.polygon_points = []
+        self.ui.graphicsView.setScene(None)
+        self.ui.label_2.clear()
+        self.ui.filename_lbl.setText('')
+        self.ui.width_lbl.setText('')
+        self.ui.height_lbl.setText('')
+        for widget in self.map_widgets:
+            widget.setEnabled(False)
 
 
     def mapClick(self, event):
         """Handle mouse clicks on the map to change cell states"""
         # get current model value
-        if self.box_select_mode or self.line_select_mode and event.button() == Qt.LeftButton:  # use the left mouse button in selection mode
-           self.rect_selecting = True
-        x = math.floor(event.scenePos().x() / self.pixels_per_cell)
-        y = math.floor(event.scenePos().y() / self.pixels_per_cell)
-        val = self.im.getpixel((x,y))
+        if self.box_select_mode and self.fill_value() is None:
+            # without a fixed color the box only selects, it never changes cells
+            return
+        x = math.floor(event.scenePos().x())
+        y = math.floor(event.scenePos().y())
+        if not self.model.contains(x, y):
+            return
+
+        # with a fixed color a click starts a freehand brush stroke
+        if not (self.box_select_mode or self.line_select_mode) and self.fill_value() is not None:
+            self.strokeTo(x, y)
+            return
+
+        val = self.model.get(x, y)
 
         if self.color == 'occupied':
             val = 0
@@ -232,97 +675,139 @@ class MapEditor(QtWidgets.QMainWindow):
             val = 200
         else:
             # determine next value in sequence white->black->gray
-            if val <= (255.0 * (1.0 - self.occupied_thresh)):  # if black, become gray
+            cls = self.class_lut[val]
+            if cls == OCCUPIED:  # if black, become gray
                 val = 200
-            elif val <= (255.0 * (1.0 - self.free_thresh)):  # else if gray, become white
+            elif cls == UNKNOWN:  # else if gray, become white
                 val = 255
             else:  # else its white, become black
                 val = 0    
 
         # update model with new value
-        self.im.putpixel((x,y), val)    
+        self.model.set(x, y, val)
+        self.logEdit({'op': 'box', 'rect': [x, y, x, y], 'value': val})
 
         # redraw cell in new color
-        color = self.value2color(val)
-
-        self.color_cell(x, y, color)
+        self.color_cell(x, y)
 
 
     def value2color(self, val):
-        if val > (255.0 * (1.0 - self.free_thresh)):
-            return Qt.white
-        elif val > (255.0 * (1.0 - self.occupied_thresh)):
-            return Qt.gray
-        else:
-            return Qt.black
-
-    def color_cell(self, x, y, color):
-        pen = QPen(color)
-        pen.setWidth(1)
-        if self.pixels_per_cell > 10:
-            pen = QPen(Qt.lightGray)
-        brush = QBrush(color)
-        #x = x * self.pixels_per_cell
-        #y = y * self.pixels_per_cell
-  
-        qrect = self.grids[x][y]
-        qrect.setBrush(brush)
-        qrect.setPen(pen)
+        return self.CLASS_COLORS[self.class_lut[val]]
 
-        
-    def add_cell(self, x, y, color):
-        pen = QPen(color)
-        pen.setWidth(1)
-        if self.pixels_per_cell > 10:
-            pen = QPen(Qt.lightGray)
-        brush = QBrush(color)
-        x = x * self.pixels_per_cell
-        y = y * self.pixels_per_cell
-        return self.scene.addRect(x, y, self.pixels_per_cell, self.pixels_per_cell, pen, brush)
-
-
-    def draw_map(self):        
-        self.scene = QtWidgets.QGraphicsScene()
+    def color_cell(self, x, y):
+        """Repaint a single cell, its color follows the value in the model"""
+        self.mark_dirty(x, y)
+
+    def mark_dirty(self, x, y, width=1, height=1):
+        """Schedule the repaint of a block of cells that was changed in the model"""
+        self.dirty.add(x, y, width, height)
+        self.scheduleFrame()
+
+    def mark_dirty_cells(self, xs, ys):
+        """Schedule the repaint of a scattered set of cells that was changed in the model"""
+        if not len(xs):
+            return
+        self.dirty.add_cells(xs, ys)
+        self.scheduleFrame()
+
+    def scheduleFrame(self):
+        """Repaint on the next frame, however many edits arrive until then"""
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+
+    @profiler.timed('paintFrame', frequent=True)
+    def paintFrame(self):
+        """Repaint every region changed since the last frame once"""
+        self.flushStroke()
+        if not self.dirty:
+            return
+        for rect in self.dirty.take():
+            self.pyramid.update(*rect)
+            self.layer.invalidate(*rect)
+            self.minimap.refresh(*rect)
+        self.scrollChanged(0)
+        self.updateUndoActions()
+
+    def updateUndoActions(self):
+        """Enable Undo and Redo only when there is something to undo or redo"""
+        history = self.history
+        self.undoAction.setEnabled(history is not None and history.can_undo())
+        self.redoAction.setEnabled(history is not None and history.can_redo())
+        if history is not None and history.lost:
+            history.lost = 0
+            print("ERROR:  An edit was too large for the undo history, it and the edits before it cannot be undone")
+            self.ui.statusbar.showMessage('The last edit is too large to undo, the undo history was cleared', 10000)
+
+    def setThresholds(self, occupied_thresh, free_thresh):
+        """Rebuild the value lookup table and class palette, only if the thresholds changed"""
+        if self.thresholds == (occupied_thresh, free_thresh):
+            return
+        self.thresholds = (occupied_thresh, free_thresh)
+        self.occupied_thresh = occupied_thresh
+        self.free_thresh = free_thresh
+
+        self.class_lut = class_lut(occupied_thresh, free_thresh)
+        colors = np.array([QtGui.QColor(color).rgb() for color in self.CLASS_COLORS], dtype=np.uint32)
+        self.class_palette = colors[self.class_lut].tolist()
+        self.updatePalette()
+
+    def setGrayscale(self, enabled):
+        """Show the raw cell values instead of their classes"""
+        self.grayscale = enabled
+        self.updatePalette()
+
+    def color_table(self):
+        """Palette of the displayed map, indexed by cell value"""
+        return self.GRAY_PALETTE if self.grayscale else self.class_palette
+
+    def updatePalette(self):
+        """Apply the current palette to the map and the minimap"""
+        if getattr(self, 'layer', None) is not None:
+            self.layer.setColorTable(self.color_table())
+        if getattr(self, 'minimap', None) is not None:
+            self.minimap.setColorTable(self.color_table())
+            self.scrollChanged(0)
+
+    @profiler.timed('draw_map')
+    def draw_map(self):
+        """Build the scene of a newly loaded map and its minimap"""
+        # owned by the session entry, freed when the map is evicted or closed
+        self.scene = MapScene(self.map_width_cells, self.map_height_cells, self.pixels_per_cell)
         self.ui.graphicsView.setScene(self.scene)
         self.scene.mousePressEvent = self.mapClick
-        self.grids = []
-
-        # draw the cells
-        self.scene.clear()
-        for x in range(0,self.map_width_cells):
-            grid_col = []
-            for y in range(0, self.map_height_cells):
-                val = self.im.getpixel((x,y))
-                color = self.value2color(val)
-                qrect = self.add_cell(x,y,color)
-                grid_col.append(qrect)
-            self.grids.append(grid_col)
-
-        # draw the grid lines
-        if self.pixels_per_cell > 10:
-            pen = QPen(Qt.lightGray)
-            pen.setWidth(1)
-            pixel_width = self.map_width_cells * self.pixels_per_cell
-            pixel_height =self. map_height_cells * self.pixels_per_cell
-            for x in range(0, pixel_width, self.pixels_per_cell):
-                self.scene.addLine(x, 0, x, pixel_height, pen)
-            for y in range(0, pixel_height, self.pixels_per_cell):
-                self.scene.addLine(0, y, pixel_width, y, pen)
+
+        # the whole map is one image item, grid lines are drawn by the scene
+        # zoomed-out tiles and the minimap are drawn from the downsampled levels
+        self.layer = MapLayer(self.pyramid, self.color_table())
+        self.scene.addItem(self.layer)
+        self.scene.setSceneRect(self.layer.boundingRect())
+
+        self.minimap = Minimap(self.pyramid, self.color_table(), self.ui.label_2.maximumSize())
+
+        # selection previews are created once and only moved or hidden afterwards
+        pen = QPen(Qt.red, 2)
+        pen.setCosmetic(True)
+        self.selection_rect = self.scene.addRect(QtCore.QRectF(), pen, QBrush(Qt.NoBrush))
+        self.selection_rect.setZValue(1)
+        self.selection_rect.hide()
+
+        pen = QPen(Qt.blue, 1, Qt.DashLine)
+        pen.setCosmetic(True)
+        self.line_preview = self.scene.addLine(QtCore.QLineF(), pen)
+        self.line_preview.setZValue(1)
+        self.line_preview.hide()
+
+        self.polygon_preview = self.scene.addPath(QtGui.QPainterPath(), pen)
+        self.polygon_preview.setZValue(1)
+        self.polygon_preview.hide()
+
+        self.ui.graphicsView.setTransform(QtGui.QTransform.fromScale(self.pixels_per_cell, self.pixels_per_cell))
 
     def centerView(self):
         """center the main view to the thumbnail position"""
-        if hasattr(self, 'im'):
-            # calculate the center position
-            center_x = self.im.size[0] // 2 
-            center_y = self.im.size[1] // 2
-            
-            # convert to scene coordinates
-            scene_x = center_x * self.scene.width() / self.im.size[0] - self.im.size[0]
-            scene_y = center_y * self.scene.height() / self.im.size[1] - self.im.size[1]
-            
-            # adjust the scrollbar position
-            self.ui.graphicsView.horizontalScrollBar().setValue(int(scene_x))
-            self.ui.graphicsView.verticalScrollBar().setValue(int(scene_y))
+        if self.model is not None:
+            # scene coordinates are cell coordinates
+            self.ui.graphicsView.centerOn(self.model.width / 2, self.model.height / 2)
 
     def auto_focus(self):
         # automatically calculate the best zoom ratio add at the end of the method
@@ -343,175 +828,307 @@ class MapEditor(QtWidgets.QMainWindow):
         # auto center view
         self.centerView()
     
+    def selectTool(self, check):
+        """the tool modes are exclusive, uncheck every tool but the given one"""
+        for other in (self.ui.boxSelectCheck, self.ui.lineSelectCheck,
+                      self.ui.polygonSelectCheck, self.ui.floodFillCheck):
+            if other is not check:
+                other.setChecked(False)
+
     def toggleBoxSelect(self, state):
         """switch to rectangle selection mode"""
         self.box_select_mode = (state == Qt.Checked)
-        if self.box_select_mode and self.ui.lineSelectCheck.isChecked():
-            self.ui.lineSelectCheck.setChecked(False)
+        if self.box_select_mode:
+            self.selectTool(self.ui.boxSelectCheck)
 
     def updateSelectionRect(self):
         """update the selection rectangle display"""
-        if hasattr(self, 'selection_rect'):
-            self.scene.removeItem(self.selection_rect)
-        
         min_x = min(self.start_pos[0], self.end_pos[0])
         max_x = max(self.start_pos[0], self.end_pos[0])
         min_y = min(self.start_pos[1], self.end_pos[1])
         max_y = max(self.start_pos[1], self.end_pos[1])
         
-        rect = QtCore.QRectF(
-            min_x * self.pixels_per_cell,
-            min_y * self.pixels_per_cell,
-            (max_x - min_x + 1) * self.pixels_per_cell,
-            (max_y - min_y + 1) * self.pixels_per_cell
-        )
-        self.selection_rect = self.scene.addRect(rect, QPen(Qt.red, 2), QBrush(Qt.NoBrush))
+        # the persistent preview item is moved in place, never re-added
+        self.selection_rect.setRect(min_x, min_y, max_x - min_x + 1, max_y - min_y + 1)
+        self.selection_rect.show()
 
+    @profiler.timed('fill.box')
     def fillSelectedArea(self):
         """fill all cells in the selected area"""
-        color = self.ui.colorBox.currentText()
-        min_x = min(self.start_pos[0], self.end_pos[0])
-        max_x = max(self.start_pos[0], self.end_pos[0])
-        min_y = min(self.start_pos[1], self.end_pos[1])
-        max_y = max(self.start_pos[1], self.end_pos[1])
-        
-        for x in range(min_x, max_x + 1):
-            for y in range(min_y, max_y + 1):
-                if 0 <= x < self.map_width_cells and 0 <= y < self.map_height_cells:
-                    self.fillCell(x, y)
+        val = self.fill_value()
+        if val is None:
+            return
+
+        # clip once, write one slice and repaint one region
+        rect = self.model.fill_rect(self.start_pos[0], self.start_pos[1],
+                                    self.end_pos[0], self.end_pos[1], val)
+        if rect is not None:
+            self.mark_dirty(*rect)
+            self.logEdit({'op': 'box', 'rect': list(self.start_pos + self.end_pos), 'value': val})
 
     def clearSelectionRect(self):
         """clear selection display"""
-        if hasattr(self, 'selection_rect'):
-            self.scene.removeItem(self.selection_rect)
-            del self.selection_rect
+        self.selection = None
+        self.selection_rect.hide()
 
 
     def fillCell(self, x, y):
         """fill a single cell"""
-        if self.color == 'occupied':
-            val = 0
-        elif self.color == 'unoccupied':
-            val = 255
-        elif self.color == 'uncertain':
-            val = 200
-        else:
+        val = self.fill_value()
+        if val is None:
             return
             
-        self.im.putpixel((x, y), val)
-        self.color_cell(x, y, self.value2color(val))
+        self.model.set(x, y, val)
+        self.color_cell(x, y)
+
+    @profiler.timed('fill.stroke', frequent=True)
+    def strokeTo(self, x, y):
+        """Extend the current brush stroke to a cell, starting a new stroke if needed"""
+        if self.stroke is None:
+            val = self.fill_value()
+            if val is None:
+                return
+            self.stroke = BrushStroke(self.model, val, self.ui.brushSizeBox.value())
+            # the whole stroke is undone as one edit
+            self.history.begin()
+        if self.stroke.add(x, y):
+            self.scheduleFrame()
+
+    def flushStroke(self):
+        """Hand the cells painted by the current stroke since the last frame to the dirty tracker"""
+        if self.stroke is not None:
+            xs, ys = self.stroke.take_dirty()
+            if len(xs):
+                self.dirty.add_cells(xs, ys)
+
+    def endStroke(self):
+        """Finish the current brush stroke, its last cells are shown on the next frame"""
+        if self.stroke is not None:
+            self.flushStroke()
+            self.history.end()
+            self.scheduleFrame()
+            # the whole stroke is journaled as one operation
+            self.logEdit({'op': 'stroke', 'points': self.stroke.points, 'radius': self.stroke.radius,
+                          'value': self.stroke.value})
+        self.stroke = None
+
+    @profiler.timed('undo')
+    def undo(self):
+        """Revert the last edit"""
+        self.endStroke()
+        rects = self.history.undo()
+        if rects is not None:
+            # the cells themselves, the undone edit may be in a saved part of the journal
+            self.logEdit(self.history.cells(undo=True))
+        self.showEditedCells(rects)
+
+    @profiler.timed('redo')
+    def redo(self):
+        """Reapply the last reverted edit"""
+        self.endStroke()
+        rects = self.history.redo()
+        if rects is not None:
+            self.logEdit(self.history.cells(undo=False))
+        self.showEditedCells(rects)
+
+    def showEditedCells(self, rects):
+        """Repaint the rectangles of cells that an undo or redo changed"""
+        for rect in rects or ():
+            self.mark_dirty(*rect)
+
+    def fill_value(self):
+        """Return the cell value for the current color, None in alternate mode"""
+        return COLOR_VALUES.get(self.color)
 
     def toggleLineSelect(self, state):
         """switch to straight line mode"""
         self.line_select_mode = (state == Qt.Checked)
-        if self.line_select_mode and self.ui.boxSelectCheck.isChecked():
-            self.ui.boxSelectCheck.setChecked(False)
+        if self.line_select_mode:
+            self.selectTool(self.ui.lineSelectCheck)
 
     def updateLinePreview(self):
         """real time update linear preview"""
-        if hasattr(self, 'line_preview'):
-            self.scene.removeItem(self.line_preview)
-        
-        # use the bresenham algorithm to calculate a straight line path
-        line_points = self.bresenham_line(self.start_pos[0], self.start_pos[1], 
-                                        self.end_pos[0], self.end_pos[1])
-        
-        # create preview path dashed line
-        path = QtGui.QPainterPath()
-        path.moveTo(self.start_pos[0] * self.pixels_per_cell, 
-                    self.start_pos[1] * self.pixels_per_cell)
-        path.lineTo(self.end_pos[0] * self.pixels_per_cell, 
-                self.end_pos[1] * self.pixels_per_cell)
-        
-        pen = QPen(Qt.blue, 1, Qt.DashLine)
-        self.line_preview = self.scene.addPath(path, pen)
+        # dashed line between the centers of the start and end cells
+        self.line_preview.setLine(self.start_pos[0] + 0.5, self.start_pos[1] + 0.5,
+                                  self.end_pos[0] + 0.5, self.end_pos[1] + 0.5)
+        self.line_preview.show()
 
+    @profiler.timed('fill.line')
     def fillLineBetweenPoints(self):
-        """Fill in the straight path between two points and perpendicular adjacent cells"""
-        points = self.bresenham_line(self.start_pos[0], self.start_pos[1],
-                                    self.end_pos[0], self.end_pos[1])
-        
-        if len(points) > 1:
-            # Calculate the primary direction of the line
-            dx = abs(self.end_pos[0] - self.start_pos[0])
-            dy = abs(self.end_pos[1] - self.start_pos[1])
-            
-            for x, y in points:
-                # Fill the center cell
-                if 0 <= x < self.map_width_cells and 0 <= y < self.map_height_cells:
-                    self.fillCell(x, y)
-                
-                # For more horizontal lines (dx > dy), fill cells above and below
-                if dx > dy:
-                    for offset in [-1, 1]:
-                        adj_y = y + offset
-                        if 0 <= adj_y < self.map_height_cells:
-                            self.fillCell(x, adj_y)
-                
-                # For more vertical lines (dx <= dy), fill cells left and right
-                else:
-                    for offset in [-1, 1]:
-                        adj_x = x + offset
-                        if 0 <= adj_x < self.map_width_cells:
-                            self.fillCell(adj_x, y)
-        else:
-            # If it's just a single point, fill it and its adjacent cells
-            for x, y in points:
-                if 0 <= x < self.map_width_cells and 0 <= y < self.map_height_cells:
-                    self.fillCell(x, y)
-                    # Fill adjacent cells in both directions
-                    for offset in [-1, 1]:
-                        adj_x = x + offset
-                        if 0 <= adj_x < self.map_width_cells:
-                            self.fillCell(adj_x, y)
-                        adj_y = y + offset
-                        if 0 <= adj_y < self.map_height_cells:
-                            self.fillCell(x, adj_y)
+        """Fill the straight path between two points, thickened to the selected line width"""
+        val = self.fill_value()
+        if val is None:
+            return
+
+        # every cell is computed once and written in a single batch
+        width = self.ui.lineWidthBox.value()
+        xs, ys = thick_line(self.start_pos[0], self.start_pos[1],
+                            self.end_pos[0], self.end_pos[1], width, self.model.data.shape)
+        if self.model.fill_points(xs, ys, val) is not None:
+            self.mark_dirty_cells(xs, ys)
+            self.logEdit({'op': 'line', 'points': [list(self.start_pos), list(self.end_pos)],
+                          'width': width, 'value': val})
 
     def clearLinePreview(self):
         """clear straight line preview"""
-        if hasattr(self, 'line_preview'):
-            self.scene.removeItem(self.line_preview)
-            del self.line_preview
-
-    def bresenham_line(self, x0, y0, x1, y1):
-        """bresenham line algorithm"""
-        points = []
-        dx = abs(x1 - x0)
-        dy = abs(y1 - y0)
-        x, y = x0, y0
-        sx = -1 if x0 > x1 else 1
-        sy = -1 if y0 > y1 else 1
-        
-        if dx > dy:
-            err = dx / 2.0
-            while x != x1:
-                points.append((x, y))
-                err -= dy
-                if err < 0:
-                    y += sy
-                    err += dx
-                x += sx
+        self.line_preview.hide()
+
+    def togglePolygonSelect(self, state):
+        """switch to polygon selection mode"""
+        self.polygon_select_mode = (state == Qt.Checked)
+        if self.polygon_select_mode:
+            self.selectTool(self.ui.polygonSelectCheck)
         else:
-            err = dy / 2.0
-            while y != y1:
-                points.append((x, y))
-                err -= dx
-                if err < 0:
-                    x += sx
-                    err += dy
-                y += sy
-                
-        points.append((x, y))
-        return points
+            self.clearPolygonPreview()
+
+    def updatePolygonPreview(self, cursor=None):
+        """show the polygon outline so far, with an open edge to the cursor"""
+        points = self.polygon_points + ([cursor] if cursor is not None else [])
+        path = QtGui.QPainterPath()
+        path.addPolygon(QtGui.QPolygonF([QtCore.QPointF(x + 0.5, y + 0.5) for x, y in points]))
+        if len(points) > 2:
+            path.closeSubpath()
+        self.polygon_preview.setPath(path)
+        self.polygon_preview.show()
+
+    @profiler.timed('fill.polygon')
+    def fillPolygon(self):
+        """Fill the cells inside the polygon, one scanline pass written in a single batch"""
+        val = self.fill_value()
+        if val is not None:
+            rows, starts, ends = polygon_spans(self.polygon_points, self.model.data.shape)
+            rect = self.model.fill_spans(rows, starts, ends, val)
+            if rect is not None:
+                self.mark_dirty(*rect)
+                self.logEdit({'op': 'polygon', 'points': [list(p) for p in self.polygon_points], 'value': val})
+        self.clearPolygonPreview()
+
+    def clearPolygonPreview(self):
+        """forget the polygon vertices and hide the preview"""
+        self.polygon_points = []
+        self.polygon_preview.hide()
+
+    def toggleFloodFill(self, state):
+        """switch to flood fill mode"""
+        self.flood_fill_mode = (state == Qt.Checked)
+        if self.flood_fill_mode:
+            self.selectTool(self.ui.floodFillCheck)
+
+    @profiler.timed('fill.flood')
+    def floodFill(self, x, y):
+        """Fill the connected region of cells in the same class as the clicked cell"""
+        val = self.fill_value()
+        if val is None or not self.model.contains(x, y):
+            return
+
+        # regions follow the displayed classes, not the raw cell values
+        connectivity = self.ui.connectivityBox.currentData()
+        region = self.model.region_at(x, y, self.occupied_thresh, self.free_thresh, connectivity)
+        rect = self.model.fill_mask(*region, val)
+        self.mark_dirty(*rect)
+        self.logEdit({'op': 'fill', 'seed': [x, y], 'connectivity': connectivity, 'value': val})
+
+    @profiler.timed('filter')
+    def applyFilter(self, apply, op):
+        """Run a filter on the box selection or the whole map and repaint once
+
+        `op` is the filter as apply_operation takes it, for the journal.
+        """
+        self.endStroke()
+        rect = apply(self.selection)
+        if rect is not None:
+            self.mark_dirty(*rect)
+            if self.selection is not None:
+                x, y, width, height = self.selection
+                op = dict(op, rect=[x, y, x + width - 1, y + height - 1])
+            self.logEdit(op)
+
+    def despeckle(self):
+        """Remove small occupied blobs after asking for the size limit"""
+        size, ok = QtWidgets.QInputDialog.getInt(self, 'Despeckle', 'Remove occupied blobs smaller than (cells):',
+                                                 self.despeckle_min_cells, 1, self.model.data.size)
+        if not ok:
+            return
+        self.despeckle_min_cells = size
+        self.applyFilter(lambda rect: filters.despeckle(self.model, self.occupied_thresh, self.free_thresh,
+                                                        size, rect),
+                         {'op': 'despeckle', 'min_size': size})
+
+    def morphology(self, op):
+        """Dilate, erode, open or close the occupied cells by one cell"""
+        self.applyFilter(lambda rect: filters.morphology(self.model, op, self.occupied_thresh,
+                                                         self.free_thresh, 1, rect),
+                         {'op': op, 'radius': 1})
+
+    def requantize(self):
+        """Snap every cell to the value of its free, unknown or occupied class"""
+        self.applyFilter(lambda rect: self.model.quantize(self.occupied_thresh, self.free_thresh, rect),
+                         {'op': 'threshold'})
 
     def closeEvent(self, event):
+        # let a running save finish before the window goes away, a running load is dropped
+        self.loader.shutdown([entry.task for entry in self.session.entries if entry.task is not None])
+        self.saver.wait()
+        self.session.close()
         self.close()
 
+    def setupProfiling(self):
+        """Time every paint of the view and show the timings in a corner of the map"""
+        view = self.ui.graphicsView
+        view.paintEvent = profiler.timed('frame', frequent=True)(
+            lambda event: QtWidgets.QGraphicsView.paintEvent(view, event))
+
+        # opaque, a translucent label would repaint the view below it on every update
+        self.profile_label = QtWidgets.QLabel(view)
+        self.profile_label.setStyleSheet('background: #202020; color: #e0e0e0; padding: 2px;')
+        self.profile_label.move(4, 4)
+        self.profile_label.show()
+
+        self.profile_timer = QtCore.QTimer(self)
+        self.profile_timer.timeout.connect(self.updateProfileOverlay)
+        self.profile_timer.start(self.PROFILE_OVERLAY_MS)
+
+    def updateProfileOverlay(self):
+        """Sample the scene counters and show the latest frame and operation times"""
+        if self.layer is None:
+            return
+        profiler.count('scene_items', len(self.scene.items()))
+        profiler.count('cached_tiles', len(self.layer.cache))
+
+        frame = profiler.last('frame')
+        text = 'frame %.1f ms' % (frame * 1e3) if frame is not None else 'frame -'
+        operation = profiler.last_operation
+        if operation is not None:
+            text += '  |  %s %.1f ms' % (operation, profiler.last(operation) * 1e3)
+        text += '  |  items %d  tiles %d' % (profiler.counters['scene_items'], profiler.counters['cached_tiles'])
+        self.profile_label.setText(text)
+        self.profile_label.adjustSize()
+
+    @profiler.timed('saveEvent')
     def saveEvent(self, event):
-        #self.im.save("map_old.pgm")
-        self.im.save(self.fn)
-        print('Saved', self.fn)
+        """Write the map on the background saver thread"""
+        if self.current is None:
+            return
+        self.endStroke()
+        entry = self.current
+        if entry.journal is not None:
+            entry.journal.checkpoint()
+        self.saver.save(self.fn, self.document, lambda fn, error: self.saveFinished.emit(entry, error))
+        # the edits a spill file kept are about to be in the map file
+        self.session.discard_spill(entry)
+        self.ui.statusbar.showMessage('Saving ' + self.fn + ' ...')
+
+    def handleSaved(self, entry, error):
+        """Report the outcome of a background save of a map entry, called on the GUI thread"""
+        fn = entry.fn
+        if entry.journal is not None:
+            entry.journal.saved(error is None)
+        if error is not None:
+            print('ERROR:  Saving', fn, 'failed:', error)
+            self.ui.statusbar.showMessage('Saving ' + fn + ' failed: ' + str(error))
+            return
+        print('Saved', fn)
+        self.ui.statusbar.showMessage('Saved ' + fn, 5000)
 
 
 if __name__ == '__main__':
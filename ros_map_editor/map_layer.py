@@ -0,0 +1,180 @@
+from PyQt5 import QtCore, QtGui, QtWidgets, sip
+
+from PyQt5.QtGui import QPen
+from PyQt5.QtCore import Qt
+
+import math
+import numpy as np
+from collections import OrderedDict
+
+
+class TileCache(object):
+    """Least recently used cache of rendered map tiles"""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.tiles = OrderedDict()
+
+    def get(self, key):
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+        return tile
+
+    def put(self, key, tile):
+        self.tiles[key] = tile
+        self.tiles.move_to_end(key)
+        while len(self.tiles) > self.capacity:
+            self.tiles.popitem(last=False)
+
+    def discard(self, key):
+        self.tiles.pop(key, None)
+
+    def clear(self):
+        self.tiles.clear()
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def nbytes(self):
+        """Memory held by the cached tile pixmaps"""
+        return sum(pix.width() * pix.height() * pix.depth() // 8 for pix in self.tiles.values())
+
+
+class MapLayer(QtWidgets.QGraphicsItem):
+    """Scene item that paints the occupancy grid as tiles of a MapPyramid
+
+    The layer works in cell coordinates, one scene unit per map cell, and
+    zooming is left to the view transform.  Level 0 tiles hold
+    TILE_SIZE x TILE_SIZE cells, every further level covers twice as many
+    cells per side at the same tile size and is cut from the matching
+    pyramid level, so zoomed-out tiles never read the full-resolution map.
+    Tiles are rendered the first time they become visible and dropped again
+    by the LRU cache.
+    """
+
+    TILE_SIZE = 256
+
+    def __init__(self, pyramid, color_table, cache_size=256):
+        super(MapLayer, self).__init__()
+        self.pyramid = pyramid
+        # the image shares its pixels with the map model, keep the array alive
+        self.data = data = pyramid.level(0)
+        height, width = data.shape
+        # a writable pointer keeps Qt from detaching the image on setColorTable
+        self.image = QtGui.QImage(sip.voidptr(data.ctypes.data), width, height, data.strides[0],
+                                  QtGui.QImage.Format_Indexed8)
+        self.image.setColorTable(color_table)
+        self.color_table = color_table
+        self.cache = TileCache(cache_size)
+
+        longest = max(width, height)
+        self.max_level = max(0, math.ceil(math.log2(longest / self.TILE_SIZE))) if longest else 0
+
+        # only repaint the part of the map that is actually exposed
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self):
+        return QtCore.QRectF(0, 0, self.image.width(), self.image.height())
+
+    def setColorTable(self, color_table):
+        """Switch to another palette, every cached tile has to be rendered again"""
+        self.image.setColorTable(color_table)
+        self.color_table = color_table
+        self.cache.clear()
+        self.update()
+
+    def levelForScale(self, device_pixels_per_cell):
+        """Pick the coarsest level that still has at least one tile pixel per device pixel"""
+        if device_pixels_per_cell >= 1:
+            return 0
+        level = math.floor(math.log2(1.0 / device_pixels_per_cell))
+        return min(level, self.max_level)
+
+    def tileCells(self, level):
+        """Number of map cells along one side of a tile at the given level"""
+        return self.TILE_SIZE << level
+
+    def tile(self, level, tx, ty):
+        """Return the pixmap of one tile, rendering it on a cache miss"""
+        key = (level, tx, ty)
+        pix = self.cache.get(key)
+        if pix is None:
+            size = self.TILE_SIZE
+            if level:
+                # one pixel per coarse cell, copied so the image owns its memory
+                block = np.ascontiguousarray(self.pyramid.level(level)[ty * size:(ty + 1) * size,
+                                                                       tx * size:(tx + 1) * size])
+                img = QtGui.QImage(sip.voidptr(block.ctypes.data), block.shape[1], block.shape[0],
+                                   block.strides[0], QtGui.QImage.Format_Indexed8).copy()
+                img.setColorTable(self.color_table)
+            else:
+                img = self.image.copy(QtCore.QRect(tx * size, ty * size, size, size).intersected(self.image.rect()))
+            pix = QtGui.QPixmap.fromImage(img)
+            self.cache.put(key, pix)
+        return pix
+
+    def paint(self, painter, option, widget=None):
+        """Draw the tiles that intersect the exposed rectangle"""
+        exposed = option.exposedRect
+        device_scale = QtWidgets.QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = self.levelForScale(device_scale)
+        cells = self.tileCells(level)
+
+        x0 = max(0, math.floor(exposed.left()))
+        y0 = max(0, math.floor(exposed.top()))
+        x1 = min(self.image.width(), math.ceil(exposed.right()))
+        y1 = min(self.image.height(), math.ceil(exposed.bottom()))
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        for ty in range(y0 // cells, (y1 - 1) // cells + 1):
+            for tx in range(x0 // cells, (x1 - 1) // cells + 1):
+                pix = self.tile(level, tx, ty)
+                left = tx * cells
+                top = ty * cells
+                width = min(cells, self.image.width() - left)
+                height = min(cells, self.image.height() - top)
+                # a coarse cell on the right or bottom edge may reach past the map
+                source = QtCore.QRectF(0, 0, width / (1 << level), height / (1 << level))
+                painter.drawPixmap(QtCore.QRectF(left, top, width, height), pix, source)
+
+    def invalidate(self, x, y, width=1, height=1):
+        """Drop every cached tile that overlaps a block of cells and repaint it"""
+        for level in range(self.max_level + 1):
+            cells = self.tileCells(level)
+            for ty in range(y // cells, (y + height - 1) // cells + 1):
+                for tx in range(x // cells, (x + width - 1) // cells + 1):
+                    self.cache.discard((level, tx, ty))
+        self.update(QtCore.QRectF(x, y, width, height))
+
+
+class MapScene(QtWidgets.QGraphicsScene):
+    """Graphics scene in cell coordinates that draws the grid lines on top of the map layer"""
+
+    def __init__(self, map_width_cells, map_height_cells, pixels_per_cell, parent=None):
+        super(MapScene, self).__init__(parent)
+        # only a handful of items that move on every mouse event, a BSP index would only cost time
+        self.setItemIndexMethod(QtWidgets.QGraphicsScene.NoIndex)
+        self.map_width_cells = map_width_cells
+        self.map_height_cells = map_height_cells
+        # on-screen size of a cell, only used to decide whether to draw the grid
+        self.pixels_per_cell = pixels_per_cell
+        self.grid_pen = QPen(Qt.lightGray)
+        self.grid_pen.setWidth(1)
+        self.grid_pen.setCosmetic(True)
+
+    def drawForeground(self, painter, rect):
+        """Draw the grid lines that fall inside the exposed rectangle"""
+        if self.pixels_per_cell <= 10:
+            return
+
+        x0 = max(0, math.floor(rect.left()))
+        x1 = min(self.map_width_cells, math.ceil(rect.right()))
+        y0 = max(0, math.floor(rect.top()))
+        y1 = min(self.map_height_cells, math.ceil(rect.bottom()))
+
+        painter.setPen(self.grid_pen)
+        lines = [QtCore.QLineF(x, y0, x, y1) for x in range(x0, x1 + 1)]
+        lines += [QtCore.QLineF(x0, y, x1, y) for y in range(y0, y1 + 1)]
+        painter.drawLines(lines)
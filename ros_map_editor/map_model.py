@@ -0,0 +1,173 @@
+"""
+Occupancy grid model backed by a NumPy array.
+
+This module has no Qt dependency, the editor window only wraps the array
+in a QImage for display.
+"""
+
+import numpy as np
+
+from ros_map_editor.regions import grow_region, spans_mask
+
+# cell classes as returned by MapModel.classify
+FREE = 0
+UNKNOWN = 1
+OCCUPIED = 2
+
+
+def class_lut(occupied_thresh, free_thresh):
+    """Return a 256 entry table mapping a pixel value to its cell class"""
+    values = np.arange(256, dtype=np.float64)
+    lut = np.full(256, OCCUPIED, dtype=np.uint8)
+    lut[values > 255.0 * (1.0 - occupied_thresh)] = UNKNOWN
+    lut[values > 255.0 * (1.0 - free_thresh)] = FREE
+    return lut
+
+
+class MapModel(object):
+    """Occupancy grid stored as a row-major uint8 array indexed as data[y, x]"""
+
+    def __init__(self, data):
+        self.data = np.ascontiguousarray(data, dtype=np.uint8)
+        # rows written since the map was loaded or last saved
+        self.dirty_rows = np.zeros(self.data.shape[0], dtype=bool)
+        # optional History that records every write made through this class
+        self.history = None
+
+    @property
+    def width(self):
+        return self.data.shape[1]
+
+    @property
+    def height(self):
+        return self.data.shape[0]
+
+    def contains(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        return int(self.data[y, x])
+
+    def set(self, x, y, val):
+        if self.history is not None:
+            self.history.record_cells(np.array([y * self.width + x]), val)
+        self.data[y, x] = val
+        self.dirty_rows[y] = True
+
+    def mark_rows(self, y, height=1):
+        """Record that rows were changed by writing to data directly"""
+        self.dirty_rows[y:y + height] = True
+
+    def take_dirty_rows(self):
+        """Return the indices of the changed rows and start tracking afresh"""
+        rows = np.flatnonzero(self.dirty_rows)
+        self.dirty_rows[:] = False
+        return rows
+
+    def clip_rect(self, x0, y0, x1, y1):
+        """Clip an inclusive cell rectangle to the map
+
+        Returns (x, y, width, height) or None if nothing is left.
+        """
+        x0, x1 = max(min(x0, x1), 0), min(max(x0, x1), self.width - 1)
+        y0, y1 = max(min(y0, y1), 0), min(max(y0, y1), self.height - 1)
+        if x1 < x0 or y1 < y0:
+            return None
+        return (x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+
+    def fill_rect(self, x0, y0, x1, y1, val):
+        """Set every cell of an inclusive rectangle, return the changed rectangle"""
+        rect = self.clip_rect(x0, y0, x1, y1)
+        if rect is not None:
+            x, y, width, height = rect
+            view = self.data[y:y + height, x:x + width]
+            if self.history is not None:
+                self.history.record_rect(x, y, view, val)
+            view[...] = val
+            self.dirty_rows[y:y + height] = True
+        return rect
+
+    def fill_points(self, xs, ys, val):
+        """Set a set of cells given as coordinate arrays, return their bounding rectangle"""
+        xs = np.asarray(xs, dtype=np.intp)
+        ys = np.asarray(ys, dtype=np.intp)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        xs = xs[inside]
+        ys = ys[inside]
+        if not xs.size:
+            return None
+        if self.history is not None:
+            self.history.record_cells(ys * self.width + xs, val)
+        self.data[ys, xs] = val
+        self.dirty_rows[ys] = True
+        x0, y0 = int(xs.min()), int(ys.min())
+        return (x0, y0, int(xs.max()) - x0 + 1, int(ys.max()) - y0 + 1)
+
+    def write_cells(self, flat, values):
+        """Set the cells with the given flat indices to one value or a value each, return their bounding rectangle"""
+        flat = np.asarray(flat, dtype=np.intp)
+        if not flat.size:
+            return None
+        if flat.min() < 0 or flat.max() >= self.data.size:
+            raise ValueError("cell index out of range")
+        cells = self.data.ravel()
+        values = np.broadcast_to(np.asarray(values, dtype=np.uint8), flat.shape)
+        if self.history is not None:
+            self.history.record(flat, cells[flat], values)
+        cells[flat] = values
+        ys, xs = np.divmod(flat, self.width)
+        self.dirty_rows[ys] = True
+        x0, y0 = int(xs.min()), int(ys.min())
+        return (x0, y0, int(xs.max()) - x0 + 1, int(ys.max()) - y0 + 1)
+
+    def fill_spans(self, rows, starts, ends, val):
+        """Set horizontal runs of cells, data[row, start:end] for each span, return their bounding rectangle"""
+        if not len(rows):
+            return None
+        # one masked write over the bounding rectangle, however many spans there are
+        return self.fill_mask(*spans_mask(rows, starts, ends), val)
+
+    def fill_mask(self, x, y, mask, val):
+        """Set the cells selected by a boolean mask placed at (x, y), return its rectangle"""
+        height, width = mask.shape
+        view = self.data[y:y + height, x:x + width]
+        return self.write_rect(x, y, np.where(mask, np.uint8(val), view))
+
+    def write_rect(self, x, y, block):
+        """Replace the cells of a rectangle starting at (x, y) with a block of values"""
+        height, width = block.shape
+        view = self.data[y:y + height, x:x + width]
+        if self.history is not None:
+            self.history.record_block(x, y, view, block)
+        view[...] = block
+        self.dirty_rows[y:y + height] = True
+        return (x, y, width, height)
+
+    def remap(self, lut, rect=None):
+        """Pass every cell, or the cells of a rectangle, through a 256 entry value table"""
+        x, y, width, height = rect if rect is not None else (0, 0, self.width, self.height)
+        block = lut[self.data[y:y + height, x:x + width]]
+        return self.write_rect(x, y, block)
+
+    def quantize(self, occupied_thresh, free_thresh, rect=None, values=(255, 205, 0)):
+        """Snap every cell to the free, unknown or occupied value of its class"""
+        lut = np.asarray(values, dtype=np.uint8)[class_lut(occupied_thresh, free_thresh)]
+        return self.remap(lut, rect)
+
+    def region_at(self, x, y, occupied_thresh, free_thresh, connectivity=4):
+        """The connected region of cells in the same class as (x, y), as (x, y, mask)
+
+        Only the neighbourhood the region reaches is classified and labeled.
+        """
+        lut = class_lut(occupied_thresh, free_thresh)
+        seed = lut[self.data[y, x]]
+        return grow_region(lambda x0, y0, width, height: lut[self.data[y0:y0 + height, x0:x0 + width]] == seed,
+                           x, y, self.width, self.height, connectivity)
+
+    def classify(self, occupied_thresh, free_thresh, rect=None):
+        """Return the FREE/UNKNOWN/OCCUPIED class of every cell, optionally of a rectangle only"""
+        data = self.data
+        if rect is not None:
+            x, y, width, height = rect
+            data = data[y:y + height, x:x + width]
+        return class_lut(occupied_thresh, free_thresh)[data]
@@ -0,0 +1,69 @@
+from PyQt5 import QtCore, QtGui, sip
+
+from PyQt5.QtGui import QPen
+from PyQt5.QtCore import Qt
+
+from ros_map_editor.pyramid import fit_level
+
+
+class Minimap(object):
+    """Overview of the map drawn from a pyramid level, cached as a pixmap of the preview size
+
+    The overview shows the first pyramid level that fits the preview, so
+    obstacles survive the downsampling and the full-resolution map is never
+    read.  Edits only redraw the overview cells they touch, once the pyramid
+    was updated, and the viewport box is painted on a copy of the small
+    cached pixmap.
+    """
+
+    def __init__(self, pyramid, color_table, size):
+        height, width = pyramid.level(0).shape
+        self.level = fit_level(width, height, min(size.width(), size.height()))
+        self.step = 1 << self.level
+
+        # the image shares its pixels with the pyramid level
+        self.small = pyramid.level(self.level)
+        small_height, small_width = self.small.shape
+        self.image = QtGui.QImage(sip.voidptr(self.small.ctypes.data), small_width, small_height,
+                                  self.small.strides[0], QtGui.QImage.Format_Indexed8)
+        self.size = size
+
+        self.box_pen = QPen(Qt.red)
+        self.box_pen.setWidth(1)
+
+        self.setColorTable(color_table)
+
+    def setColorTable(self, color_table):
+        """Switch to another palette and redraw the cached overview"""
+        self.image.setColorTable(color_table)
+        # scale once to the preview size, the label then shows it unscaled
+        self.pixmap = QtGui.QPixmap.fromImage(self.image).scaled(self.size, Qt.KeepAspectRatio,
+                                                                 Qt.FastTransformation)
+        self.scale_x = self.pixmap.width() / self.image.width()
+        self.scale_y = self.pixmap.height() / self.image.height()
+
+    def refresh(self, x, y, width=1, height=1):
+        """Redraw the overview cells covering a block of map cells, the pyramid must be updated first"""
+        step = self.step
+        c0, c1 = x // step, (x + width - 1) // step
+        r0, r1 = y // step, (y + height - 1) // step
+
+        source = QtCore.QRectF(c0, r0, c1 - c0 + 1, r1 - r0 + 1)
+        target = QtCore.QRectF(c0 * self.scale_x, r0 * self.scale_y,
+                               source.width() * self.scale_x, source.height() * self.scale_y)
+        painter = QtGui.QPainter(self.pixmap)
+        painter.drawImage(target, self.image, source)
+        painter.end()
+
+    def render(self, view_rect):
+        """Return the cached overview with the visible area, given in cells, drawn as a red box"""
+        pix = QtGui.QPixmap(self.pixmap)
+        scale_x = self.scale_x / self.step
+        scale_y = self.scale_y / self.step
+
+        painter = QtGui.QPainter(pix)
+        painter.setPen(self.box_pen)
+        painter.drawRect(QtCore.QRectF(view_rect.x() * scale_x, view_rect.y() * scale_y,
+                                       view_rect.width() * scale_x, view_rect.height() * scale_y))
+        painter.end()
+        return pix
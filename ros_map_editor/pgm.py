@@ -0,0 +1,231 @@
+"""
+Reader and writer for PGM (portable graymap) files.
+
+Binary (P5) pixel data is memory-mapped straight into a NumPy array instead
+of being decoded and copied, plain (P2) files are parsed as text.  Maps with
+a maxval above 255 are stored as 16-bit big-endian samples and rescaled to
+the 0-255 range the editor works with, from_uint8 scales them back for
+writing so a map keeps its maxval.  The module does not depend on Qt
+and can be used from scripts.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class PGMError(ValueError):
+    """Raised when a file is not a PGM image this module can read"""
+
+
+class PGMHeader(object):
+    """Parsed PGM header: magic number, size, maxval and pixel data offset"""
+
+    def __init__(self, magic, width, height, maxval, offset):
+        self.magic = magic
+        self.width = width
+        self.height = height
+        self.maxval = maxval
+        self.offset = offset
+
+    @property
+    def binary(self):
+        return self.magic == b'P5'
+
+    @property
+    def sample_dtype(self):
+        """Data type of one stored sample of a binary file"""
+        return np.dtype(np.uint8) if self.maxval < 256 else np.dtype('>u2')
+
+
+def _tokens(f):
+    """Yield the whitespace separated header tokens, skipping comments
+
+    Stops right after the single whitespace byte that ends the last token,
+    which is where binary pixel data starts.
+    """
+    token = b''
+    while True:
+        c = f.read(1)
+        if not c:
+            if token:
+                yield token
+            return
+        if c == b'#':
+            f.readline()
+            if token:
+                yield token
+                token = b''
+        elif c.isspace():
+            if token:
+                yield token
+                token = b''
+        else:
+            token += c
+
+
+def read_header(f):
+    """Parse the header of an open binary file object"""
+    tokens = _tokens(f)
+    try:
+        magic = next(tokens)
+        if magic not in (b'P2', b'P5'):
+            raise PGMError("not a PGM file (magic number %r)" % magic)
+        width, height, maxval = (int(next(tokens)) for _ in range(3))
+    except StopIteration:
+        raise PGMError("truncated PGM header")
+    except ValueError as e:
+        if isinstance(e, PGMError):
+            raise
+        raise PGMError("malformed PGM header")
+    if width <= 0 or height <= 0 or not 0 < maxval < 65536:
+        raise PGMError("invalid PGM size or maxval")
+    return PGMHeader(magic, width, height, maxval, f.tell())
+
+
+def read_pgm(fn, mmap=True):
+    """Read a PGM file into a (height, width) array of raw samples
+
+    P5 data is memory-mapped copy-on-write when `mmap` is set, so the array
+    can be edited without touching the file.  Returns (data, header), the
+    data is uint8 for maxval < 256 and uint16 otherwise.
+    """
+    with open(fn, 'rb') as f:
+        header = read_header(f)
+        shape = (header.height, header.width)
+
+        if not header.binary:
+            values = np.array(f.read().split(), dtype=np.uint16)
+            if values.size < header.width * header.height:
+                raise PGMError("truncated PGM pixel data")
+            data = values[:header.width * header.height].reshape(shape)
+            if header.maxval < 256:
+                data = data.astype(np.uint8)
+            return data, header
+
+        dtype = header.sample_dtype
+        if mmap:
+            try:
+                data = np.memmap(fn, dtype=dtype, mode='c', offset=header.offset, shape=shape)
+            except ValueError:
+                raise PGMError("truncated PGM pixel data")
+        else:
+            data = np.fromfile(f, dtype=dtype, count=header.width * header.height)
+            if data.size < header.width * header.height:
+                raise PGMError("truncated PGM pixel data")
+            data = data.reshape(shape)
+
+    if dtype.byteorder == '>':
+        # a plain in-memory array, the byte-swapped copy no longer maps the file
+        data = np.array(data, dtype=np.uint16)
+    return data, header
+
+
+def to_uint8(data, maxval):
+    """Rescale raw samples to the 0-255 range, 8-bit data with maxval 255 is returned as is"""
+    if data.dtype == np.uint8 and maxval == 255:
+        return data
+    scaled = (data.astype(np.uint32) * 255 + maxval // 2) // maxval
+    return np.minimum(scaled, 255).astype(np.uint8)
+
+
+def from_uint8(data, maxval, raw=None, band=1024):
+    """Scale 0-255 cells back to samples of `maxval`, the inverse of to_uint8
+
+    Cells that still hold the value their sample in `raw` was read as keep
+    that sample, so unedited cells of a 16-bit map lose no precision.  Works
+    a band of rows at a time to bound the temporary memory.
+    """
+    dtype = np.dtype(np.uint8) if maxval < 256 else np.dtype(np.uint16)
+    if maxval == 255 and raw is None:
+        return data.astype(dtype)
+    out = np.empty(data.shape, dtype=dtype)
+    for y in range(0, data.shape[0], band):
+        cells = data[y:y + band]
+        samples = (cells.astype(np.uint32) * maxval + 127) // 255
+        if raw is not None:
+            original = raw[y:y + band]
+            samples = np.where(to_uint8(original, maxval) == cells, original, samples)
+        out[y:y + band] = samples
+    return out
+
+
+def load(fn, mmap=True):
+    """Read a PGM file as a uint8 array scaled to 0-255"""
+    data, header = read_pgm(fn, mmap)
+    return to_uint8(data, header.maxval)
+
+
+def header_bytes(width, height, maxval=255, magic=b'P5'):
+    return b'%s\n%d %d\n%d\n' % (magic, width, height, maxval)
+
+
+def write_pgm(fn, data, maxval=255, plain=False):
+    """Write a (height, width) array as a binary P5 PGM file, plain P2 text with `plain`
+
+    The image is written to a temporary file next to `fn` that then replaces
+    it, so the old file stays intact until the new one is complete and a
+    copy-on-write mapping of it from read_pgm stays valid.
+    """
+    height, width = data.shape
+    dtype = np.dtype(np.uint8) if maxval < 256 else np.dtype('>u2')
+    directory, name = os.path.split(os.path.abspath(fn))
+    fd, tmp = tempfile.mkstemp(prefix='.' + name + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if plain:
+                f.write(header_bytes(width, height, maxval, b'P2'))
+                np.savetxt(f, data, fmt='%d')
+            else:
+                f.write(header_bytes(width, height, maxval))
+                f.write(np.ascontiguousarray(data, dtype=dtype).data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(fn):
+            shutil.copymode(fn, tmp)
+        else:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, fn)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def can_patch(fn, shape, maxval=255):
+    """Check whether `fn` is a binary PGM of the given shape whose rows can be patched in place"""
+    try:
+        with open(fn, 'rb') as f:
+            header = read_header(f)
+            size = os.fstat(f.fileno()).st_size
+    except (OSError, PGMError):
+        return False
+    height, width = shape
+    return (header.binary and header.maxval == maxval and
+            (header.height, header.width) == (height, width) and
+            size >= header.offset + width * height * header.sample_dtype.itemsize)
+
+
+def patch_rows(fn, rows, row_data, maxval=255):
+    """Overwrite some rows of an existing binary PGM file in place
+
+    `rows` are sorted row indices and `row_data` holds their new samples, one
+    row per index.  Consecutive rows are written with a single call.
+    """
+    rows = np.asarray(rows)
+    if not rows.size:
+        return
+    dtype = np.dtype(np.uint8) if maxval < 256 else np.dtype('>u2')
+    row_data = np.ascontiguousarray(row_data, dtype=dtype)
+    with open(fn, 'r+b') as f:
+        header = read_header(f)
+        row_bytes = header.width * dtype.itemsize
+        # split the rows into runs of consecutive indices
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        for start, stop in zip(np.r_[0, breaks], np.r_[breaks, rows.size]):
+            f.seek(header.offset + int(rows[start]) * row_bytes)
+            f.write(row_data[start:stop].data)
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,161 @@
+"""
+Opt-in timing instrumentation.
+
+Off by default and close to free while off.  It is switched on with the
+``--profile`` command line flag or the ROS_MAP_EDITOR_PROFILE environment
+variable, whose value is the file the results are written to on exit
+("1" picks the default name):
+
+    ROS_MAP_EDITOR_PROFILE=profile.json ros_map_editor maps/map
+
+Every timed operation feeds a histogram of its durations and a trace
+event, counters such as the number of scene items are sampled alongside.
+The dump is a JSON object with the histograms next to a ``traceEvents``
+list, so the same file loads in chrome://tracing or Perfetto.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ENV_VAR = 'ROS_MAP_EDITOR_PROFILE'
+DEFAULT_FILE = 'ros_map_editor_profile.json'
+
+
+class Histogram(object):
+    """Durations of one operation, bucketed by powers of two microseconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.buckets = {}
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1e3,
+            'mean_ms': self.total / self.count * 1e3 if self.count else 0.0,
+            'max_ms': self.max * 1e3,
+            # upper bound of each bucket in milliseconds and its number of calls
+            'buckets': {'%g' % ((1 << bucket) / 1e3): n for bucket, n in sorted(self.buckets.items())},
+        }
+
+
+class Profiler(object):
+    """Collects histograms, counters and trace events while enabled"""
+
+    # trace events kept at most, later ones only go into the histograms
+    MAX_EVENTS = 200000
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.histograms = {}
+        self.counters = {}
+        self.events = []
+        self.dropped = 0
+        # latest operation that is not timed on every frame or event
+        self.last_operation = None
+
+    def enable(self):
+        self.enabled = True
+
+    def record(self, name, start, seconds, frequent=False):
+        """Add one finished operation that began at perf_counter time `start`"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+            if not frequent:
+                self.last_operation = name
+            if len(self.events) < self.MAX_EVENTS:
+                self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                    'ts': (start - self.start) * 1e6, 'dur': seconds * 1e6})
+            else:
+                self.dropped += 1
+
+    @contextmanager
+    def span(self, name):
+        """Time the body of a with block"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start)
+
+    def timed(self, name, frequent=False):
+        """Decorator timing every call of a function, checked at call time so it can be enabled later
+
+        Frequent operations, run for every frame or event, are not reported
+        as the last operation.
+        """
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, start, time.perf_counter() - start, frequent)
+            return wrapper
+        return decorate
+
+    def count(self, name, value):
+        """Sample a counter such as the number of scene items"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = value
+            if len(self.events) < self.MAX_EVENTS:
+                self.events.append({'name': name, 'ph': 'C', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                    'ts': (time.perf_counter() - self.start) * 1e6, 'args': {name: value}})
+
+    def last(self, name):
+        """Duration in seconds of the latest call of an operation, None if it never ran"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            return histogram.last if histogram else None
+
+    def dump(self, fn):
+        """Write histograms, counters and trace events as one JSON file"""
+        with self.lock:
+            doc = {
+                'histograms': {name: h.to_dict() for name, h in sorted(self.histograms.items())},
+                'counters': dict(self.counters),
+                'droppedEvents': self.dropped,
+                'displayTimeUnit': 'ms',
+                'traceEvents': list(self.events),
+            }
+        with open(fn, 'w') as f:
+            json.dump(doc, f)
+
+
+def output_file(value):
+    """Name of the dump file for a flag or environment value, None when profiling is off"""
+    if not value or value == '0':
+        return None
+    return DEFAULT_FILE if value == '1' else value
+
+
+# the instance every module reports to
+profiler = Profiler(enabled=output_file(os.environ.get(ENV_VAR)) is not None)
@@ -0,0 +1,166 @@
+"""
+Multi-resolution pyramid of a map.
+
+Every level halves the size of the one below it.  A coarse cell takes the
+minimum of the cells it covers, and since 0 is occupied an obstacle is never
+lost, unknown wins over free in the same way.  Levels are built lazily from
+the one below and edits are pushed up into the levels that exist, so the
+minimap and zoomed-out rendering never go back to the full-resolution map.
+
+Levels can be exported next to the map as ordinary PGM/YAML pairs with a
+scaled resolution:
+
+    ros-map-editor pyramid maps/map.pgm --levels 3
+
+and are picked up again when the map is opened, as long as they are newer
+than the map itself.
+"""
+
+import argparse
+import math
+import os
+import sys
+
+import numpy as np
+
+from ros_map_editor import pgm
+from ros_map_editor.core import MapDocument, MapLoadError, yaml_file
+
+
+def downsample(data):
+    """Halve a map, each coarse cell keeps the minimum of its 2x2 block"""
+    height, width = data.shape
+    if height % 2 or width % 2:
+        # cells past the edge must not win the minimum, pad with free space
+        padded = np.full((height + height % 2, width + width % 2), 255, dtype=np.uint8)
+        padded[:height, :width] = data
+        data = padded
+    return np.minimum(np.minimum(data[0::2, 0::2], data[0::2, 1::2]),
+                      np.minimum(data[1::2, 0::2], data[1::2, 1::2]))
+
+
+def fit_level(width, height, size):
+    """First level of a width x height map whose larger side fits into `size` cells"""
+    return max(0, math.ceil(math.log2(max(width, height, 1) / max(1, size))))
+
+
+def level_file(fn, level):
+    """Name of the exported image of a pyramid level"""
+    stem, ext = os.path.splitext(fn)
+    return '%s_level%d%s' % (stem, level, ext or '.pgm')
+
+
+class MapPyramid(object):
+    """Levels of a map, level 0 is the map array itself"""
+
+    def __init__(self, data, levels=()):
+        self.levels = [data]
+        for level in levels:
+            self.levels.append(level)
+
+    @classmethod
+    def load(cls, data, fn):
+        """Start from the levels exported next to `fn` that are still up to date"""
+        levels = []
+        try:
+            mtime = os.path.getmtime(fn)
+        except OSError:
+            return cls(data)
+        shape = data.shape
+        while True:
+            name = level_file(fn, len(levels) + 1)
+            shape = ((shape[0] + 1) // 2, (shape[1] + 1) // 2)
+            try:
+                if os.path.getmtime(name) < mtime:
+                    break
+                level = pgm.load(name)
+            except (OSError, pgm.PGMError):
+                break
+            if level.shape != shape:
+                break
+            levels.append(level)
+        return cls(data, levels)
+
+    def level(self, n):
+        """Return level n, building it and the ones below it on first use"""
+        while len(self.levels) <= n:
+            self.levels.append(downsample(self.levels[-1]))
+        return self.levels[n]
+
+    def build(self, n, band=256):
+        """Build the levels up to n a band of rows at a time
+
+        A generator that yields the fraction of the work done after every
+        band, so the loader can report progress and stop in between.
+        """
+        shapes = []
+        shape = self.levels[-1].shape
+        for _ in range(len(self.levels), n + 1):
+            shape = ((shape[0] + 1) // 2, (shape[1] + 1) // 2)
+            shapes.append(shape)
+        total = sum(h * w for h, w in shapes) or 1
+        done = 0
+
+        for shape in shapes:
+            finer = self.levels[-1]
+            level = np.empty(shape, dtype=np.uint8)
+            for y in range(0, shape[0], band):
+                level[y:y + band] = downsample(finer[2 * y:2 * (y + band)])
+                done += level[y:y + band].size
+                yield done / total
+            self.levels.append(level)
+
+    def update(self, x, y, width=1, height=1):
+        """Recompute the built levels after a block of level 0 cells changed"""
+        x1, y1 = x + width, y + height
+        for n in range(1, len(self.levels)):
+            # the coarse cells covering the block, from the finer level
+            x, y, x1, y1 = x // 2, y // 2, (x1 + 1) // 2, (y1 + 1) // 2
+            finer = self.levels[n - 1][2 * y:2 * y1, 2 * x:2 * x1]
+            self.levels[n][y:y1, x:x1] = downsample(finer)
+
+
+def export(doc, pyramid, levels):
+    """Write levels 1 to `levels` next to the map, return the written image names"""
+    written = []
+    height = doc.model.height
+    ox, oy = doc.origin[0], doc.origin[1]
+    yaw = doc.origin[2] if len(doc.origin) > 2 else 0.0
+    for n in range(1, levels + 1):
+        data = pyramid.level(n)
+        fn = level_file(doc.fn, n)
+        pgm.write_pgm(fn, data)
+
+        # padding at the bottom moves the lower left corner the origin refers to
+        resolution = doc.resolution * 2 ** n
+        pad = data.shape[0] * 2 ** n - height
+        shift = pad * doc.resolution
+        origin = [ox + shift * math.sin(yaw), oy - shift * math.cos(yaw)] + list(doc.origin[2:])
+        doc.save_metadata(yaml_file(fn), image=os.path.basename(fn), resolution=resolution, origin=origin)
+        written.append(fn)
+    return written
+
+
+def main(argv=None):
+    """Entry point of the pyramid subcommand, returns the process exit code"""
+    parser = argparse.ArgumentParser(prog='ros-map-editor pyramid',
+                                     description='Export downsampled copies of maps that keep every obstacle')
+    parser.add_argument('maps', nargs='+', help='Map files (.pgm or without extension)')
+    parser.add_argument('-l', '--levels', type=int, default=3,
+                        help='Number of levels to write, each halves the size (default: 3)')
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for fn in args.maps:
+        try:
+            doc = MapDocument.load(fn)
+            for out in export(doc, MapPyramid(doc.model.data), args.levels):
+                print('Saved', out)
+        except (MapLoadError, OSError) as e:
+            failed += 1
+            print("ERROR: ", fn, "-", e)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Vectorized rasterizers that turn shapes into arrays of map cells.
+
+All functions return the cells as a pair of (xs, ys) index arrays that can be
+handed to MapModel.fill_points in one batched write.
+"""
+
+import numpy as np
+
+
+def unique_cells(xs, ys, shape):
+    """Drop cells outside a (height, width) map and remove duplicates"""
+    height, width = shape
+    xs = np.asarray(xs, dtype=np.intp)
+    ys = np.asarray(ys, dtype=np.intp)
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    flat = np.unique(ys[inside] * width + xs[inside])
+    return flat % width, flat // width
+
+
+def line_cells(x0, y0, x1, y1):
+    """Cells of the straight line between two cells, one per step along the major axis"""
+    steps = max(abs(x1 - x0), abs(y1 - y0))
+    if steps == 0:
+        return np.array([x0], dtype=np.intp), np.array([y0], dtype=np.intp)
+    t = np.arange(steps + 1, dtype=np.float64) / steps
+    xs = np.rint(x0 + t * (x1 - x0)).astype(np.intp)
+    ys = np.rint(y0 + t * (y1 - y0)).astype(np.intp)
+    return xs, ys
+
+
+def thick_line(x0, y0, x1, y1, width, shape):
+    """Cells of a line that is `width` cells wide across its minor axis
+
+    Mostly horizontal lines are thickened vertically and vice versa, a single
+    point is thickened in both directions.  The result is clipped to the map
+    shape and free of duplicates.
+    """
+    xs, ys = line_cells(x0, y0, x1, y1)
+    offsets = np.arange(-((width - 1) // 2), width // 2 + 1, dtype=np.intp)
+
+    dx = abs(x1 - x0)
+    dy = abs(y1 - y0)
+    parts_x = []
+    parts_y = []
+    if dx > dy or dx == dy == 0:
+        parts_x.append(np.repeat(xs, offsets.size))
+        parts_y.append((ys[:, None] + offsets).ravel())
+    if dx <= dy:
+        parts_x.append((xs[:, None] + offsets).ravel())
+        parts_y.append(np.repeat(ys, offsets.size))
+
+    return unique_cells(np.concatenate(parts_x), np.concatenate(parts_y), shape)
+
+
+def disk_offsets(radius):
+    """Cell offsets of a round brush, radius 0 is a single cell"""
+    r = np.arange(-radius, radius + 1, dtype=np.intp)
+    dx, dy = np.meshgrid(r, r)
+    inside = dx * dx + dy * dy <= radius * radius
+    return dx[inside], dy[inside]
+
+
+def brush_cells(xs, ys, radius, shape):
+    """Stamp a round brush on every given cell, clipped and free of duplicates"""
+    xs = np.asarray(xs, dtype=np.intp)
+    ys = np.asarray(ys, dtype=np.intp)
+    if radius > 0:
+        dx, dy = disk_offsets(radius)
+        xs = (xs[:, None] + dx).ravel()
+        ys = (ys[:, None] + dy).ravel()
+    return unique_cells(xs, ys, shape)
+
+
+def polygon_spans(points, shape):
+    """Horizontal spans of the cells inside a polygon, using the even-odd rule
+
+    `points` are the polygon vertices in cell coordinates, each vertex sits at
+    the center of its cell.  A cell is inside when its center is.  Returns
+    (rows, starts, ends) arrays, with `ends` exclusive and everything clipped
+    to the (height, width) map shape.
+    """
+    height, width = shape
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2) + 0.5
+    empty = np.empty(0, dtype=np.intp)
+    if len(pts) < 3:
+        return empty, empty, empty
+
+    x0, y0 = pts[:, 0], pts[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+    # an edge crosses the rows whose center lies in [min(y0, y1), max(y0, y1))
+    lo = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, height).astype(np.intp)
+    hi = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, height).astype(np.intp)
+    counts = np.maximum(hi - lo, 0)
+    if not counts.sum():
+        return empty, empty, empty
+
+    edge = np.repeat(np.arange(len(pts)), counts)
+    first = np.cumsum(counts) - counts
+    rows = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(first, counts)
+    centers = rows + 0.5
+    xs = x0[edge] + (centers - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+
+    # every row has an even number of crossings, consecutive pairs bound the inside
+    order = np.lexsort((xs, rows))
+    rows = rows[order][0::2]
+    xs = xs[order]
+    starts = np.clip(np.ceil(xs[0::2] - 0.5), 0, width).astype(np.intp)
+    ends = np.clip(np.ceil(xs[1::2] - 0.5), 0, width).astype(np.intp)
+    keep = ends > starts
+    return rows[keep], starts[keep], ends[keep]
@@ -0,0 +1,131 @@
+"""
+Connected regions of map cells.
+
+A boolean mask is split into horizontal runs of set cells, runs on adjacent
+rows that touch are linked and the links are merged into components with a
+vectorized union-find.  Everything works on whole arrays, there is no
+recursion and no per-cell Python loop, so regions of millions of cells are
+labeled in a fraction of a second.
+"""
+
+import numpy as np
+
+
+def mask_runs(mask):
+    """Horizontal runs of True cells in a 2D mask
+
+    Returns (rows, starts, ends) arrays sorted by row and start, `ends`
+    exclusive.
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    # +1 where a run starts and -1 just past its end, both in row-major order
+    rows, cols = np.nonzero(np.diff(padded, axis=1))
+    return rows[0::2], cols[0::2], cols[1::2]
+
+
+def run_links(rows, starts, ends, width, connectivity=4):
+    """Pairs of indices (a, b) of runs on consecutive rows that touch
+
+    With 8-connectivity runs that only meet at a corner are linked too.
+    """
+    # runs are sorted and disjoint within a row, so are their ends, and
+    # flattening (row, x) keeps the order across rows
+    stride = width + 2
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    reach = 1 if connectivity == 8 else 0
+    below = (rows + 1) * stride
+    # b on the next row overlaps a when end_b + reach > start_a and start_b < end_a + reach
+    lo = np.searchsorted(end_keys, below + starts - reach, side='right')
+    hi = np.searchsorted(start_keys, below + ends + reach, side='left')
+    counts = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(rows.size), counts)
+    first = np.cumsum(counts) - counts
+    b = np.repeat(lo - first, counts) + np.arange(counts.sum())
+    return a, b
+
+
+def label_runs(count, a, b):
+    """Component label of each of `count` runs linked by pairs (a, b)
+
+    Every label is the smallest run index of its component.
+    """
+    labels = np.arange(count)
+    while a.size:
+        # hook the root of every link onto the smaller of its two roots
+        la = labels[a]
+        lb = labels[b]
+        if (la == lb).all():
+            break
+        low = np.minimum(la, lb)
+        np.minimum.at(labels, la, low)
+        np.minimum.at(labels, lb, low)
+        # compress the paths until every run points at its root
+        while True:
+            parents = labels[labels]
+            if (parents == labels).all():
+                break
+            labels = parents
+    return labels
+
+
+def spans_mask(rows, starts, ends):
+    """Rasterize spans into a mask over their bounding rectangle
+
+    Returns (x, y, mask), the mask covering the cells from (x, y) on.
+    """
+    x, y = int(starts.min()), int(rows.min())
+    height = int(rows.max()) - y + 1
+    width = int(ends.max()) - x
+    edges = np.zeros((height, width + 1), dtype=np.int8)
+    # spans of a row are disjoint, so starts and ends are each unique and
+    # buffered fancy-index updates need no np.add.at
+    edges[rows - y, starts - x] += 1
+    edges[rows - y, ends - x] -= 1
+    return x, y, np.cumsum(edges[:, :-1], axis=1, dtype=np.int8) > 0
+
+
+def region_at(mask, x, y, connectivity=4):
+    """The connected region of True cells containing (x, y)
+
+    Returns (x, y, region), a mask over the bounding rectangle of the region,
+    or None if the cell itself is not set.
+    """
+    if not mask[y, x]:
+        return None
+    rows, starts, ends = mask_runs(mask)
+    a, b = run_links(rows, starts, ends, mask.shape[1], connectivity)
+    labels = label_runs(rows.size, a, b)
+
+    seed = np.flatnonzero((rows == y) & (starts <= x) & (ends > x))[0]
+    inside = labels == labels[seed]
+    return spans_mask(rows[inside], starts[inside], ends[inside])
+
+
+def grow_region(select, x, y, width, height, connectivity=4, size=64):
+    """The connected region containing (x, y) of a width x height map, labeled in a window around it
+
+    `select(x, y, width, height)` returns the boolean mask of a window of
+    the map.  The window doubles in size until the region no longer touches
+    one of its sides that is not the map edge, so the cost follows the size
+    of the region rather than the map.  Returns what region_at returns, in
+    map coordinates.
+    """
+    while True:
+        x0, y0 = max(0, x - size), max(0, y - size)
+        x1, y1 = min(width, x + size + 1), min(height, y + size + 1)
+        found = region_at(select(x0, y0, x1 - x0, y1 - y0), x - x0, y - y0, connectivity)
+        if found is None:
+            return None
+        rx, ry, region = found
+        rh, rw = region.shape
+        # a region reaching a side of the window may go on past it
+        if not ((rx == 0 and x0 > 0) or (ry == 0 and y0 > 0) or
+                (rx + rw == x1 - x0 and x1 < width) or (ry + rh == y1 - y0 and y1 < height)):
+            return rx + x0, ry + y0, region
+        size *= 2
+        if (2 * size + 1) ** 2 * 2 > width * height:
+            # a window covering most of the map costs little less than all of it
+            size = max(width, height)
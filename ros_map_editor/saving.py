@@ -0,0 +1,64 @@
+"""
+Background saving of maps.
+
+A snapshot of the map is taken on the calling thread and written by a
+single worker thread, so saves never block the GUI and are applied in the
+order they were requested.  When only a few rows changed since the last
+save and the file on disk still has the same layout, just those rows are
+patched in place, otherwise the whole file is rewritten atomically.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ros_map_editor import pgm
+from ros_map_editor.profiling import profiler
+
+
+class MapSaver(object):
+    """Writes MapDocument snapshots to PGM files on a worker thread"""
+
+    # patch rows in place while at most this fraction of the map changed
+    PATCH_FRACTION = 0.25
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def save(self, fn, document, callback=None):
+        """Snapshot the map of `document` and write it to `fn` in the background, in the document's format
+
+        `callback(fn, error)` is called from the worker thread when the write
+        finished, `error` is None on success.  Returns the future of the write.
+        """
+        model = document.model
+        rows = model.take_dirty_rows()
+        patch = (rows.size <= self.PATCH_FRACTION * model.height and not document.plain and
+                 pgm.can_patch(fn, model.data.shape, document.maxval))
+        if patch:
+            future = self.executor.submit(self.write, 'save.patch', pgm.patch_rows, fn, rows,
+                                          document.samples(rows), document.maxval)
+        else:
+            future = self.executor.submit(self.write, 'save.write', pgm.write_pgm, fn,
+                                          document.samples(copy=True), document.maxval, document.plain)
+
+        def done(future):
+            error = future.exception()
+            if error is not None:
+                # the file no longer matches the tracked rows, rewrite it next time
+                model.mark_rows(0, model.height)
+            if callback is not None:
+                callback(fn, error)
+
+        future.add_done_callback(done)
+        return future
+
+    def write(self, name, func, *args):
+        """Run one write on the worker thread, timed when profiling"""
+        with profiler.span(name):
+            func(*args)
+
+    def wait(self):
+        """Block until every pending save has been written"""
+        self.executor.submit(lambda: None).result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
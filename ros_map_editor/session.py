@@ -0,0 +1,194 @@
+"""
+Maps open in one editor session.
+
+The editor keeps every map it opened as a MapEntry, switching to a map that
+is still loaded only swaps its scene back in.  Everything a loaded map
+holds on to, its cells, pyramid levels, undo history and rendered tiles,
+counts against a memory budget, and when the session goes over it the
+least recently used maps are evicted.  An evicted map with unsaved edits is
+first spilled to a temporary file and loaded from there the next time it is
+shown, so its edits survive while its undo history does not.
+"""
+
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from ros_map_editor.core import yaml_file
+from ros_map_editor.profiling import profiler
+
+
+class MapEntry(object):
+    """One map of the session, loaded or evicted"""
+
+    def __init__(self, fn):
+        # the map file, saves always go here even when loading from a spill file
+        self.fn = fn
+        self.spill = None
+        self.evicted = False
+        # the load running for this map
+        self.task = None
+        # crash recovery journal, kept while the map is evicted
+        self.journal = None
+
+        self.document = None
+        self.pyramid = None
+        self.history = None
+        # set by the editor: scene, map layer, minimap and the view position
+        self.scene = None
+        self.layer = None
+        self.minimap = None
+        self.view = None
+
+    @property
+    def loaded(self):
+        return self.document is not None
+
+    @property
+    def model(self):
+        return self.document.model if self.document is not None else None
+
+    def source(self):
+        """File the map is loaded from, its spill file after an eviction with unsaved edits"""
+        return self.spill or self.fn
+
+    def unsaved(self):
+        """Whether the map has edits that are not in its file"""
+        if self.loaded:
+            return bool(self.model.dirty_rows.any())
+        return self.spill is not None
+
+    def nbytes(self):
+        """Memory held by the loaded map, its raw samples, derived levels and rendered tiles"""
+        if not self.loaded:
+            return 0
+        size = sum(level.nbytes for level in self.pyramid.levels)
+        raw = self.document.raw
+        # raw samples of maps that are not 8-bit, a mapped file costs no memory
+        if raw is not None and not isinstance(raw, np.memmap):
+            size += raw.nbytes
+        if self.history is not None:
+            size += self.history.nbytes
+        if self.layer is not None:
+            size += self.layer.cache.nbytes()
+        return size
+
+    def unload(self):
+        """Drop everything the loaded map holds"""
+        self.document = None
+        self.pyramid = None
+        self.history = None
+        self.scene = None
+        self.layer = None
+        self.minimap = None
+        self.view = None
+
+
+class MapSession(object):
+    """Open maps in tab order, loaded ones kept within a memory budget"""
+
+    def __init__(self, max_bytes=2 * 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = []
+        # loaded entries, least recently used first
+        self.recent = OrderedDict()
+        self.spill_dir = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, fn):
+        """Entry of a map file, None if it is not open"""
+        path = os.path.abspath(fn)
+        for entry in self.entries:
+            if os.path.abspath(entry.fn) == path:
+                return entry
+        return None
+
+    def add(self, fn):
+        """Open another map, returns its entry, not loaded yet"""
+        entry = MapEntry(fn)
+        self.entries.append(entry)
+        return entry
+
+    def remove(self, entry):
+        """Close a map for good, its spill file is deleted"""
+        self.entries.remove(entry)
+        self.recent.pop(id(entry), None)
+        self.discard_spill(entry)
+        if entry.journal is not None:
+            entry.journal.close()
+            entry.journal = None
+        entry.unload()
+
+    def touch(self, entry):
+        """Mark a loaded entry as the most recently used one"""
+        self.recent[id(entry)] = entry
+        self.recent.move_to_end(id(entry))
+
+    def nbytes(self):
+        return sum(entry.nbytes() for entry in self.recent.values())
+
+    def evict(self, keep=None):
+        """Unload least recently used maps until the session fits its budget, return the evicted entries
+
+        `keep` is never evicted.  An entry whose spill file cannot be written
+        stays loaded.
+        """
+        evicted = []
+        size = self.nbytes()
+        for entry in list(self.recent.values()):
+            if size <= self.max_bytes:
+                break
+            if entry is keep:
+                continue
+            freed = entry.nbytes()
+            if entry.unsaved():
+                try:
+                    self.spill(entry)
+                except OSError as e:
+                    print("ERROR:  Cannot spill", entry.fn, "-", e)
+                    continue
+            else:
+                # saved since it was loaded from its spill file
+                self.discard_spill(entry)
+            del self.recent[id(entry)]
+            entry.unload()
+            entry.evicted = True
+            evicted.append(entry)
+            size -= freed
+        return evicted
+
+    @profiler.timed('session.spill')
+    def spill(self, entry):
+        """Write the cells and metadata of a loaded entry to its spill file"""
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='ros_map_editor_session_')
+        if entry.spill is None:
+            fd, entry.spill = tempfile.mkstemp(suffix='_' + os.path.basename(entry.fn), dir=self.spill_dir)
+            os.close(fd)
+        entry.document.save(entry.spill)
+        entry.document.save_metadata(yaml_file(entry.spill), image=os.path.basename(entry.spill))
+
+    def discard_spill(self, entry):
+        """Forget the spill file of an entry, once it was saved or closed"""
+        if entry.spill is not None:
+            for fn in (entry.spill, yaml_file(entry.spill)):
+                try:
+                    os.remove(fn)
+                except OSError:
+                    pass
+            entry.spill = None
+
+    def close(self):
+        """Write out the journals and remove the spill directory with every spill file left in it"""
+        for entry in self.entries:
+            if entry.journal is not None:
+                entry.journal.close()
+                entry.journal = None
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
@@ -119,6 +119,26 @@ class Ui_MapEditor(object):
         self.colorBox.setObjectName("colorBox")
         self.controls_layout_row1.addWidget(self.colorBox)
 
+        self.brushSizeLabel = QtWidgets.QLabel(self.controls_group)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.brushSizeLabel.sizePolicy().hasHeightForWidth())
+        self.brushSizeLabel.setSizePolicy(sizePolicy)
+        self.brushSizeLabel.setObjectName("brushSizeLabel")
+        self.controls_layout_row1.addWidget(self.brushSizeLabel)
+
+        self.brushSizeBox = QtWidgets.QSpinBox(self.controls_group)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.brushSizeBox.sizePolicy().hasHeightForWidth())
+        self.brushSizeBox.setSizePolicy(sizePolicy)
+        self.brushSizeBox.setMinimum(0)
+        self.brushSizeBox.setMaximum(50)
+        self.brushSizeBox.setObjectName("brushSizeBox")
+        self.controls_layout_row1.addWidget(self.brushSizeBox)
+
         self.zoom_label = QtWidgets.QLabel(self.controls_group)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Preferred)
         sizePolicy.setHorizontalStretch(0)
@@ -183,6 +203,27 @@ class Ui_MapEditor(object):
         self.lineSelectCheck.setObjectName("line mode_select")
         self.controls_layout_row3.addWidget(self.lineSelectCheck)
 
+        self.lineWidthLabel = QtWidgets.QLabel(self.controls_group)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.lineWidthLabel.sizePolicy().hasHeightForWidth())
+        self.lineWidthLabel.setSizePolicy(sizePolicy)
+        self.lineWidthLabel.setObjectName("lineWidthLabel")
+        self.controls_layout_row3.addWidget(self.lineWidthLabel)
+
+        self.lineWidthBox = QtWidgets.QSpinBox(self.controls_group)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.lineWidthBox.sizePolicy().hasHeightForWidth())
+        self.lineWidthBox.setSizePolicy(sizePolicy)
+        self.lineWidthBox.setMinimum(1)
+        self.lineWidthBox.setMaximum(99)
+        self.lineWidthBox.setProperty("value", 3)
+        self.lineWidthBox.setObjectName("lineWidthBox")
+        self.controls_layout_row3.addWidget(self.lineWidthBox)
+
         self.boxSelectCheck = QtWidgets.QCheckBox(self.controls_group)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
         sizePolicy.setHorizontalStretch(0)
@@ -192,8 +233,40 @@ class Ui_MapEditor(object):
         self.boxSelectCheck.setObjectName("box mode_select")
         self.controls_layout_row3.addWidget(self.boxSelectCheck)
 
+        self.polygonSelectCheck = QtWidgets.QCheckBox(self.controls_group)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.polygonSelectCheck.sizePolicy().hasHeightForWidth())
+        self.polygonSelectCheck.setSizePolicy(sizePolicy)
+        self.polygonSelectCheck.setObjectName("polygon mode_select")
+        self.controls_layout_row3.addWidget(self.polygonSelectCheck)
+
         self.controls_layout_vertical.addLayout(self.controls_layout_row3)
 
+        self.controls_layout_row4 = QtWidgets.QHBoxLayout()
+        self.controls_layout_row4.setObjectName("controls_layout_row4")
+
+        self.floodFillCheck = QtWidgets.QCheckBox(self.controls_group)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.floodFillCheck.sizePolicy().hasHeightForWidth())
+        self.floodFillCheck.setSizePolicy(sizePolicy)
+        self.floodFillCheck.setObjectName("flood mode_select")
+        self.controls_layout_row4.addWidget(self.floodFillCheck)
+
+        self.connectivityBox = QtWidgets.QComboBox(self.controls_group)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.connectivityBox.sizePolicy().hasHeightForWidth())
+        self.connectivityBox.setSizePolicy(sizePolicy)
+        self.connectivityBox.setObjectName("connectivityBox")
+        self.controls_layout_row4.addWidget(self.connectivityBox)
+
+        self.controls_layout_vertical.addLayout(self.controls_layout_row4)
+
         self.horizontalLayout_bottom.addWidget(self.controls_group)
         self.verticalLayout.addLayout(self.horizontalLayout_bottom)
 
@@ -224,12 +297,18 @@ class Ui_MapEditor(object):
         self.cell_lbl.setText(_translate("MapEditor", "TextLabel"))
         self.controls_group.setTitle(_translate("MapEditor", "Controls"))
         self.color_label.setText(_translate("MapEditor", "Color"))
+        self.brushSizeLabel.setText(_translate("MapEditor", "Brush"))
+        self.brushSizeBox.setToolTip(_translate("MapEditor", "Brush radius in cells"))
         self.zoom_label.setText(_translate("MapEditor", "Zoom"))
         self.focusButton.setText(_translate("MapEditor", "Center"))
         self.saveButton.setText(_translate("MapEditor", "Save"))
         self.closeButton.setText(_translate("MapEditor", "Close"))
         self.boxSelectCheck.setText(_translate("MapEditor", "Box Selection Mode"))
         self.lineSelectCheck.setText(_translate("MapEditor", "Line Selection Mode"))
+        self.polygonSelectCheck.setText(_translate("MapEditor", "Polygon Selection Mode"))
+        self.lineWidthLabel.setText(_translate("MapEditor", "Width"))
+        self.floodFillCheck.setText(_translate("MapEditor", "Flood Fill Mode"))
+        self.connectivityBox.setToolTip(_translate("MapEditor", "Which neighbours of a cell belong to its region"))
 
 if __name__ == "__main__":
     import sys
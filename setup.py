@@ -37,12 +37,13 @@ setup(
     include_package_data=True,
     install_requires=[
         "PyQt5>=5.15.0",
-        "Pillow>=8.0.0",
         "PyYAML>=5.1.0",
+        "numpy>=1.17.0",
     ],
     entry_points={
         "console_scripts": [
             "ros_map_editor=ros_map_editor.main:main",
+            "ros-map-editor=ros_map_editor.main:main",
         ],
     },
     classifiers=[